@@ -7,11 +7,14 @@ from pathlib import Path
 from click.testing import CliRunner
 from xnat4tests.base import start_xnat, stop_xnat
 from xnat4tests.config import Config
+from xnat4tests.clients import docker_client
 from xnat4tests.utils import set_loggers
 
 
 set_loggers("debug")
 
+pytest_plugins = ["pytester"]
+
 
 @pytest.fixture()
 def work_dir():  # Makes the home dir show up on test output
@@ -55,7 +58,7 @@ def config(home_dir, xnat_root_dir):
 @pytest.fixture(scope="session")
 def launched_xnat(config):
 
-    dc = docker.from_env()
+    dc = docker_client(config)
     try:
         container = dc.containers.get(config.docker_container)
     except docker.errors.NotFound:
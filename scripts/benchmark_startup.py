@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Benchmarks the time it takes from launching a fresh XNAT container until the first
+login succeeds, along with the startup time reported by Tomcat, for different image
+build variants, e.g.
+
+    $ python3 scripts/benchmark_startup.py --repeats 3 cold warm cds
+
+The saving of each variant is reported relative to the first variant
+"""
+import re
+import time
+import argparse
+import statistics
+import attrs
+from xnat4tests import start_xnat, stop_xnat, Config
+from xnat4tests.utils import set_loggers
+
+
+# Build args that are overridden for each variant
+VARIANTS = {
+    "cold": {},
+    "warm": {"warm_schema": True},
+    "cds": {"jvm_cds": True},
+    "warm-cds": {"warm_schema": True, "jvm_cds": True},
+    "fast-tomcat": {"tomcat_profile": "fast"},
+}
+
+TOMCAT_STARTUP_RE = re.compile(r"Server startup in \[?(\d+)\]? m")
+
+
+def variant_config(base: Config, variant: str) -> Config:
+    build_args = attrs.asdict(base.build_args)
+    build_args.update(VARIANTS[variant])
+    name = f"{base.docker_image}-bench-{variant}"
+    return attrs.evolve(
+        base,
+        docker_image=name,
+        docker_container=name,
+        build_args=build_args,
+    )
+
+
+def benchmark(config: Config, repeats: int):
+    start_xnat(config)  # Build the image (if required) outside of the timings
+    stop_xnat(config, wait=True)
+    times = []
+    tomcat_times = []
+    for _ in range(repeats):
+        start = time.monotonic()
+        container = start_xnat(config, rebuild=False, relaunch=True)
+        times.append(time.monotonic() - start)
+        tomcat_times.append(tomcat_startup_time(container))
+        stop_xnat(config, wait=True)
+    return times, tomcat_times
+
+
+def tomcat_startup_time(container):
+    """Reads the startup time reported by Tomcat from its log in the container"""
+    _, output = container.exec_run("cat /var/log/tomcat/tomcat.log")
+    match = TOMCAT_STARTUP_RE.search(output.decode(errors="replace"))
+    return int(match.group(1)) / 1000 if match else float("nan")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "variants", nargs="*", default=list(VARIANTS), choices=list(VARIANTS)
+    )
+    parser.add_argument("--config", default="default")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--loglevel", default="warning")
+    args = parser.parse_args()
+
+    set_loggers(args.loglevel)
+    base_config = Config.load(args.config)
+
+    results = {}
+    for variant in args.variants:
+        results[variant] = benchmark(variant_config(base_config, variant), args.repeats)
+
+    baseline = statistics.mean(next(iter(results.values()))[0])
+    print(
+        f"\n{'variant':<12}{'mean (s)':>10}{'min (s)':>10}{'max (s)':>10}"
+        f"{'saving (s)':>12}{'tomcat (s)':>12}"
+    )
+    for variant, (times, tomcat_times) in results.items():
+        mean = statistics.mean(times)
+        print(
+            f"{variant:<12}{mean:>10.1f}{min(times):>10.1f}{max(times):>10.1f}"
+            f"{baseline - mean:>12.1f}{statistics.mean(tomcat_times):>12.1f}"
+        )
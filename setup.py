@@ -33,7 +33,8 @@ setup(
         "console_scripts": [
             "xnat4tests=xnat4tests.cli:cli",
             "x4t=xnat4tests.cli:cli",
-        ]
+        ],
+        "pytest11": ["xnat4tests.testing=xnat4tests.testing"],
     },
     include_package_data=True,
     cmdclass=versioneer.get_cmdclass(),
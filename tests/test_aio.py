@@ -0,0 +1,60 @@
+import asyncio
+from unittest import mock
+import pytest
+from xnat4tests import aio, base
+from xnat4tests.aio import async_start_xnat, async_wait_for_http
+from xnat4tests.base import _Launched
+from xnat4tests.config import Config
+
+
+def test_async_wait_for_http_timeout():
+
+    configs = [
+        Config(docker_host="127.0.0.1", xnat_port=str(port), readiness_timeout=1)
+        for port in (1, 2)
+    ]
+
+    async def wait_for_all():
+        return await asyncio.gather(
+            *(async_wait_for_http(c) for c in configs), return_exceptions=True
+        )
+
+    results = asyncio.run(wait_for_all())
+
+    assert all(isinstance(r, TimeoutError) for r in results)
+
+
+def test_async_start_xnat(config, launched_xnat):
+
+    # The instance is already running so should be reused
+    container = asyncio.run(async_start_xnat(config, rebuild=False))
+
+    assert container.name == config.docker_container
+
+
+@pytest.mark.parametrize(
+    "relaunched,phases",
+    [(True, ["postgres_ready", "tomcat_ready"]), (False, ["xnat_ready"])],
+)
+def test_async_start_xnat_probe_phases(monkeypatch, relaunched, phases):
+
+    config = Config(readiness_check="probe")
+    launched = _Launched(container=mock.Mock(), relaunched=relaunched)
+    timers = []
+
+    def launch_container(config, timer, **kwargs):
+        timers.append(timer)
+        return launched
+
+    async def wait_for_http(config):
+        pass
+
+    monkeypatch.setattr(aio, "_launch_container", launch_container)
+    monkeypatch.setattr(aio, "async_wait_for_http", wait_for_http)
+    monkeypatch.setattr(aio, "_initialise", mock.Mock())
+    monkeypatch.setattr(base, "postgres_ready_after", lambda c: 0.0)
+
+    asyncio.run(async_start_xnat(config))
+
+    # Recorded the same way as the synchronous start so the timings are comparable
+    assert [p for p in timers[0].phases if p != "config_load"] == phases
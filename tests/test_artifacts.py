@@ -0,0 +1,17 @@
+from xnat4tests.artifacts import _verify, _sha256, CHECKSUM_EXT
+
+
+def test_artifact_checksum(work_dir):
+
+    artifact = work_dir / "an-artifact.jar"
+    artifact.write_bytes(b"some bytes")
+
+    assert not _verify(artifact)  # no recorded checksum
+
+    (work_dir / ("an-artifact.jar" + CHECKSUM_EXT)).write_text(
+        f"{_sha256(artifact)}  an-artifact.jar\n"
+    )
+    assert _verify(artifact)
+
+    artifact.write_bytes(b"some other bytes")
+    assert not _verify(artifact)
@@ -1,6 +1,18 @@
+import os
 import tempfile
+import subprocess
 from pathlib import Path
-from xnat4tests import connect
+from unittest import mock
+import docker
+import pytest
+import requests
+from xnat4tests import connect, base
+from xnat4tests.base import stop_container, reset_xnat
+from xnat4tests.config import Config
+from xnat4tests.timing import StartupTimer
+
+
+DOCKER_SRC = Path(base.__file__).parent / "docker-src"
 
 
 def test_launch(config, launched_xnat):
@@ -37,3 +49,318 @@ def test_launch(config, launched_xnat):
             p.name
             for p in (config.xnat_root_dir / "archive" / PROJECT / "arc001").iterdir()
         ] == [SESSION]
+
+
+@pytest.mark.parametrize(
+    "auto_remove,wait_for_removal,condition",
+    [
+        (True, True, "removed"),
+        (True, False, "not-running"),
+        (False, True, "not-running"),
+    ],
+)
+def test_stop_container(auto_remove, wait_for_removal, condition):
+    container = mock.Mock(attrs={"HostConfig": {"AutoRemove": auto_remove}})
+    stop_container(container, wait_for_removal=wait_for_removal, timeout=10)
+    container.stop.assert_called_once_with()
+    container.wait.assert_called_once_with(condition=condition, timeout=10)
+
+
+def test_stop_container_already_removed():
+    container = mock.Mock(attrs={"HostConfig": {"AutoRemove": True}})
+    container.wait.side_effect = docker.errors.NotFound("gone")
+    stop_container(container, wait_for_removal=True)
+
+
+def test_stop_container_timeout():
+    container = mock.Mock(attrs={"HostConfig": {"AutoRemove": True}})
+    container.wait.side_effect = requests.exceptions.ReadTimeout()
+    with pytest.raises(TimeoutError):
+        stop_container(container, wait_for_removal=True, timeout=1)
+
+
+def test_stop_container_daemon_error():
+    container = mock.Mock(attrs={"HostConfig": {"AutoRemove": True}})
+    container.wait.side_effect = requests.exceptions.ConnectionError("refused")
+    # Errors other than timeouts aren't reported as timeouts
+    with pytest.raises(requests.exceptions.ConnectionError):
+        stop_container(container, wait_for_removal=True, timeout=1)
+
+
+@pytest.fixture
+def xnat_container(config, monkeypatch):
+    container = mock.Mock()
+    container.exec_run.return_value = mock.Mock(exit_code=0, output=b"")
+    dc = mock.Mock()
+    dc.containers.get.return_value = container
+    monkeypatch.setattr(base, "docker_client", lambda config: dc)
+    monkeypatch.setattr(base, "wait_for_http", mock.Mock())
+    monkeypatch.setattr(base, "new_session", mock.MagicMock())
+    return container
+
+
+def test_reset_xnat(config, xnat_container):
+    reset_xnat(config)
+    xnat_container.exec_run.assert_called_once_with(["/usr/local/bin/reset-xnat.sh"])
+    base.wait_for_http.assert_called_once_with(config)
+
+
+@pytest.mark.parametrize(
+    "exit_code,output",
+    [
+        (1, b"No template of the XNAT database has been taken"),
+        (126, b"OCI runtime exec failed: no such file or directory"),
+    ],
+)
+def test_reset_xnat_no_template(config, xnat_container, exit_code, output):
+    xnat_container.exec_run.return_value = mock.Mock(
+        exit_code=exit_code, output=output
+    )
+    with pytest.raises(RuntimeError, match="reset_template: true"):
+        reset_xnat(config)
+
+
+def test_reset_xnat_failed(config, xnat_container):
+    xnat_container.exec_run.return_value = mock.Mock(
+        exit_code=1, output=b"pg_restore: error: could not read input file"
+    )
+    with pytest.raises(RuntimeError, match="pg_restore"):
+        reset_xnat(config)
+
+
+def test_reset_xnat_not_running(config, xnat_container):
+    base.docker_client(config).containers.get.side_effect = docker.errors.NotFound("")
+    with pytest.raises(RuntimeError, match=config.xnat_uri):
+        reset_xnat(config)
+
+
+@pytest.mark.parametrize("reset_template", [True, False])
+def test_initialise_reset_template(
+    xnat_container, work_dir, monkeypatch, reset_template
+):
+    monkeypatch.setattr(base, "_configure_container_service", mock.Mock())
+    config = Config(reset_template=reset_template, reports_dir=work_dir)
+    launched = base._Launched(container=xnat_container, relaunched=True)
+    base._initialise(launched, config, mock.MagicMock())
+    if reset_template:
+        xnat_container.exec_run.assert_called_once_with([base.RESET_SCRIPT, "-t"])
+    else:
+        xnat_container.exec_run.assert_not_called()
+
+
+def test_initialise_reset_template_failed(xnat_container, work_dir, monkeypatch):
+    monkeypatch.setattr(base, "_configure_container_service", mock.Mock())
+    # e.g. an image built by an older version without the reset script
+    xnat_container.exec_run.return_value = mock.Mock(
+        exit_code=126, output=b"OCI runtime exec failed: no such file or directory"
+    )
+    config = Config(reset_template=True, reports_dir=work_dir)
+    launched = base._Launched(container=xnat_container, relaunched=True)
+    base._initialise(launched, config, mock.MagicMock())
+
+
+FAKE_COMMAND = """#!/bin/sh
+echo "$(basename $0) $*" >> "$COMMAND_LOG"
+case "$*" in
+  *"datname='xnat_template'"*) echo "$TEMPLATE_EXISTS" ;;
+esac
+"""
+
+
+@pytest.fixture
+def reset_script(work_dir, monkeypatch):
+    """Runs reset-xnat.sh with the commands it calls replaced by ones that log their
+    arguments"""
+    bin_dir = work_dir / "bin"
+    bin_dir.mkdir()
+    for cmd in ("supervisorctl", "psql", "pg_dump", "pg_restore", "find"):
+        (bin_dir / cmd).write_text(FAKE_COMMAND)
+        (bin_dir / cmd).chmod(0o755)
+    log = work_dir / "commands.log"
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("COMMAND_LOG", str(log))
+    monkeypatch.setenv("XNAT_TEMPLATE_DUMP", str(work_dir / "template.dump"))
+    monkeypatch.setenv("TEMPLATE_EXISTS", "")
+
+    def run(*args):
+        log.write_text("")
+        result = subprocess.run(
+            ["sh", str(DOCKER_SRC / "reset-xnat.sh")] + list(args),
+            capture_output=True,
+            text=True,
+        )
+        return result.returncode, log.read_text().splitlines()
+
+    return run
+
+
+def test_reset_script_take_template(reset_script):
+    returncode, commands = reset_script("-t")
+    assert returncode == 0
+    assert commands[0].startswith("pg_dump ")
+    assert not any(c.startswith("supervisorctl") for c in commands)
+
+
+def test_reset_script_no_template(reset_script):
+    returncode, commands = reset_script()
+    assert returncode == 1
+    # The database must be left alone if there is nothing to recreate it from
+    assert not any("DROP DATABASE" in c for c in commands)
+
+
+def test_reset_script_from_template_dump(reset_script, work_dir):
+    (work_dir / "template.dump").write_bytes(b"dump")
+    returncode, commands = reset_script()
+    assert returncode == 0
+    assert commands[0] == "supervisorctl -c /etc/supervisord.conf stop tomcat"
+    assert (
+        f"pg_restore -U postgres -d xnat --exit-on-error {work_dir}/template.dump"
+        in commands
+    )
+    assert any("CREATE DATABASE xnat_template TEMPLATE xnat" in c for c in commands)
+    assert commands[-1] == "supervisorctl -c /etc/supervisord.conf start tomcat"
+
+
+def test_reset_script_from_template_db(reset_script, monkeypatch):
+    monkeypatch.setenv("TEMPLATE_EXISTS", "1")
+    returncode, commands = reset_script()
+    assert returncode == 0
+    assert any("CREATE DATABASE xnat TEMPLATE xnat_template" in c for c in commands)
+    assert not any(c.startswith("pg_restore") for c in commands)
+
+
+def test_reset_script_dump_stopped(reset_script, work_dir):
+    returncode, commands = reset_script("-s", "-d", str(work_dir / "snapshot.dump"))
+    assert returncode == 0
+    assert (
+        f"pg_restore -U postgres -d xnat --exit-on-error {work_dir}/snapshot.dump"
+        in commands
+    )
+    assert len([c for c in commands if c.startswith("find")]) == 4
+    # Tomcat is left stopped
+    assert commands[0] == "supervisorctl -c /etc/supervisord.conf stop tomcat"
+    assert not any(c.endswith("start tomcat") for c in commands)
+
+
+@pytest.mark.parametrize(
+    "postgres_up,phases",
+    [(2.0, ["postgres_ready", "tomcat_ready"]), (None, ["xnat_ready"])],
+)
+def test_wait_until_ready_phases(config, monkeypatch, postgres_up, phases):
+    monkeypatch.setattr(base, "wait_for_health", mock.Mock())
+    monkeypatch.setattr(base, "postgres_ready_after", lambda c: postgres_up)
+    timer = StartupTimer()
+    base._wait_until_ready(mock.Mock(), config, timer)
+    assert list(timer.phases) == phases
+
+
+def test_wait_until_ready_reused(config, monkeypatch):
+    monkeypatch.setattr(base, "wait_for_health", mock.Mock())
+    postgres_ready_after = mock.Mock(return_value=2.0)
+    monkeypatch.setattr(base, "postgres_ready_after", postgres_ready_after)
+    timer = StartupTimer()
+    base._wait_until_ready(mock.Mock(), config, timer, relaunched=False)
+    assert list(timer.phases) == ["xnat_ready"]
+    postgres_ready_after.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "relaunched,startup,phases",
+    [
+        (True, {"postgres_up": 2.0, "tomcat_started": 5.0}, [2.0, 3.0]),
+        (True, {"tomcat_started": 5.0}, [1.0, 4.0]),
+        (False, {"tomcat_started": 0.5}, [0.5]),
+    ],
+)
+def test_wait_until_ready_logs(config, monkeypatch, relaunched, startup, phases):
+    config.readiness_check = "logs"
+    monkeypatch.setattr(base, "wait_for_logs", lambda c, config: startup)
+    monkeypatch.setattr(base, "postgres_ready_after", lambda c: 1.0)
+    timer = StartupTimer()
+    base._wait_until_ready(mock.Mock(), config, timer, relaunched=relaunched)
+    if relaunched:
+        assert list(timer.phases) == ["postgres_ready", "tomcat_ready"]
+    else:
+        assert list(timer.phases) == ["xnat_ready"]
+    assert list(timer.phases.values()) == phases
+
+
+@pytest.fixture
+def warm_env(config, monkeypatch):
+    image = mock.Mock(tags=[f"{config.docker_image}:latest"])
+    warm_image = mock.Mock(tags=[f"{config.docker_image}:warm"])
+    dc = mock.Mock()
+    dc.containers.get.side_effect = docker.errors.NotFound("")
+    monkeypatch.setattr(base, "docker_client", lambda config: dc)
+    monkeypatch.setattr(base, "build_image", lambda config, dc: image)
+    monkeypatch.setattr(base, "warm_image_tag", lambda config, image: "warm")
+    monkeypatch.setattr(base, "docker_network", mock.Mock())
+    monkeypatch.setattr(base, "release_sessions", mock.Mock())
+    return dc, image, warm_image
+
+
+def test_launch_warm_snapshot_reused(config, warm_env):
+    dc, _, warm_image = warm_env
+    dc.images.get.return_value = warm_image
+    launched = base._launch_container(
+        config,
+        StartupTimer(),
+        keep_mounts=True,
+        rebuild=True,
+        relaunch=False,
+        warm_snapshot=True,
+    )
+    assert launched.from_warm_snapshot
+    assert dc.containers.run.call_args.args[0] == f"{config.docker_image}:warm"
+
+
+def test_launch_warm_snapshot_committed(config, warm_env, monkeypatch):
+    dc, image, _ = warm_env
+    dc.images.get.side_effect = docker.errors.ImageNotFound("")
+    launched = base._launch_container(
+        config,
+        StartupTimer(),
+        keep_mounts=True,
+        rebuild=True,
+        relaunch=False,
+        warm_snapshot=True,
+    )
+    assert not launched.from_warm_snapshot
+    assert launched.warm_tag == "warm"
+    assert dc.containers.run.call_args.args[0] == image.tags[0]
+    # Once initialised, the container is committed to the warm snapshot
+    monkeypatch.setattr(base, "new_session", mock.MagicMock())
+    monkeypatch.setattr(base, "_configure_container_service", mock.Mock())
+    launched.container.exec_run.return_value = mock.Mock(exit_code=0, output=b"")
+    launched.container.client.images.list.return_value = []
+    base._initialise(launched, config, mock.MagicMock())
+    launched.container.commit.assert_called_once_with(
+        repository=config.docker_image,
+        tag="warm",
+        changes=[f"LABEL {base.WARM_SNAPSHOT_LABEL}={config.docker_container}"],
+    )
+
+
+def test_remove_stale_warm_snapshots(config):
+    container = mock.Mock()
+    images = container.client.images
+    repo = config.docker_image
+    images.list.return_value = [
+        mock.Mock(tags=[f"{repo}:warm-new"]),
+        mock.Mock(tags=[f"{repo}:warm-old", "myregistry/xnat:pinned"]),
+        mock.Mock(tags=[f"{repo}:warm-in-use"]),
+    ]
+
+    def remove(tag):
+        if tag.endswith("in-use"):
+            raise docker.errors.APIError("image is being used by a container")
+
+    images.remove.side_effect = remove
+    base._remove_stale_warm_snapshots(container, config, "warm-new")
+    assert images.list.call_args.kwargs["filters"] == {
+        "label": f"{base.WARM_SNAPSHOT_LABEL}={config.docker_container}"
+    }
+    assert [c.args[0] for c in images.remove.call_args_list] == [
+        f"{repo}:warm-old",
+        f"{repo}:warm-in-use",
+    ]
@@ -0,0 +1,123 @@
+import json
+import tarfile
+from unittest import mock
+import pytest
+from xnat4tests.build import (
+    FINGERPRINT_LABEL,
+    build_fingerprint,
+    warm_image_tag,
+    write_build_context,
+    _build_args,
+    _stream_build,
+)
+from xnat4tests.config import Config
+from xnat4tests.utils import PipeStream
+
+
+def test_build_fingerprint():
+
+    fingerprint = build_fingerprint(Config(build_args={"java_mx": "1g"}))
+
+    assert fingerprint == build_fingerprint(Config(build_args={"java_mx": "1g"}))
+    assert fingerprint != build_fingerprint(Config(build_args={"java_mx": "2g"}))
+
+
+def test_build_args():
+
+    build_args = _build_args(Config(build_args={"warm_schema": True}))
+
+    assert build_args["WARM_SCHEMA"] == "true"
+    assert build_args["JAVA_MX"] == "2g"
+
+
+def test_stream_build_report(home_dir):
+
+    config = Config(reports_dir=home_dir / "reports")
+
+    class MockDockerClient:
+        class api:
+            @staticmethod
+            def build(**kwargs):
+                yield {"stream": "Step 1/2 : FROM tomcat:9-jre8-alpine"}
+                yield {"stream": "\n"}
+                yield {"stream": " ---> Using cache\n"}
+                yield {"stream": "Step 2/2 : RUN apk add --no-cache postgresql"}
+                yield {"stream": "\n"}
+                yield {"stream": "Successfully built 0123456789ab\n"}
+
+        class images:
+            @staticmethod
+            def get(image_id):
+                return image_id
+
+    assert _stream_build(config, MockDockerClient, "a-fingerprint") == "0123456789ab"
+
+    with open(config.reports_dir / "builds.jsonl") as f:
+        report = json.loads(f.readlines()[-1])
+    assert report["fingerprint"] == "a-fingerprint"
+    assert [(s["step"], s["cached"]) for s in report["steps"]] == [
+        (1, True),
+        (2, False),
+    ]
+    assert all("seconds" in s for s in report["steps"])
+    assert report["status"] == "succeeded"
+    assert report["builder"] == "classic"
+
+
+def test_stream_build_failed_report(home_dir):
+
+    config = Config(reports_dir=home_dir / "failed-reports")
+
+    class MockDockerClient:
+        class api:
+            @staticmethod
+            def build(**kwargs):
+                yield {"stream": "Step 1/2 : FROM tomcat:9-jre8-alpine\n"}
+                yield {"error": "pull access denied"}
+
+    with pytest.raises(RuntimeError, match="pull access denied"):
+        _stream_build(config, MockDockerClient, "a-fingerprint")
+
+    with open(config.reports_dir / "builds.jsonl") as f:
+        report = json.loads(f.readlines()[-1])
+    assert report["status"] == "failed"
+    assert [s["step"] for s in report["steps"]] == [1]
+
+
+def test_build_context(work_dir):
+
+    artifact = work_dir / "xnat-web.war"
+    artifact.write_bytes(b"a web-app")
+
+    with PipeStream(
+        lambda f: write_build_context(
+            f,
+            {
+                "artifacts/xnat-web.war": artifact,
+                "xnat-prefs-init.ini": b"[siteConfig]\n",
+            },
+        )
+    ) as context:
+        with tarfile.open(fileobj=context, mode="r|") as tar:
+            contents = {
+                m.name: tar.extractfile(m).read() for m in tar if m.isfile()
+            }
+
+    assert "Dockerfile" in contents
+    assert contents["artifacts/xnat-web.war"] == b"a web-app"
+    assert contents["xnat-prefs-init.ini"] == b"[siteConfig]\n"
+
+
+def test_warm_image_tag():
+
+    image = mock.Mock(labels={FINGERPRINT_LABEL: "a-fingerprint"})
+    tag = warm_image_tag(Config(), image)
+
+    assert tag.startswith("warm-")
+    assert tag == warm_image_tag(Config(), image)
+    assert tag != warm_image_tag(
+        Config(xnat_mnt_modes={"prearchive": "tmpfs"}), image
+    )
+    assert tag != warm_image_tag(
+        Config(), mock.Mock(labels={FINGERPRINT_LABEL: "another-fingerprint"})
+    )
@@ -0,0 +1,84 @@
+from unittest import mock
+import pytest
+import docker
+from xnat4tests import clients
+from xnat4tests.clients import (
+    docker_client,
+    set_docker_client,
+    close_docker_clients,
+    lease_session,
+    release_sessions,
+)
+
+
+@pytest.fixture
+def client_env(monkeypatch):
+    monkeypatch.setattr(clients, "_docker_clients", {})
+    monkeypatch.setenv("DOCKER_HOST", "tcp://localhost:2375")
+    from_env = mock.Mock(side_effect=lambda **kw: mock.Mock(spec=docker.DockerClient))
+    monkeypatch.setattr(docker, "from_env", from_env)
+    return from_env
+
+
+def test_docker_client_shared(client_env, config, monkeypatch):
+    client = docker_client(config)
+    assert docker_client(config) is client
+    client_env.assert_called_once_with(max_pool_size=config.docker_pool_size)
+    # A different daemon gets a different client
+    monkeypatch.setenv("DOCKER_HOST", "tcp://otherhost:2375")
+    assert docker_client(config) is not client
+
+
+def test_set_docker_client(client_env, config):
+    stand_in = mock.Mock(spec=docker.DockerClient)
+    set_docker_client(stand_in)
+    assert docker_client(config) is stand_in
+    set_docker_client(None)
+    assert docker_client(config) is not stand_in
+
+
+def test_close_docker_clients(client_env, config):
+    client = docker_client(config)
+    close_docker_clients()
+    client.close.assert_called_once_with()
+    assert docker_client(config) is not client
+
+
+@pytest.fixture
+def session_env(monkeypatch):
+    monkeypatch.setattr(clients, "_xnat_sessions", {})
+    new_session = mock.Mock(side_effect=lambda config, parse_model: mock.Mock())
+    monkeypatch.setattr(clients, "new_session", new_session)
+    return new_session
+
+
+def test_lease_session_reused(session_env, config):
+    with lease_session(config) as session:
+        pass
+    with lease_session(config) as reused:
+        assert reused is session
+        # Concurrent leases get their own sessions
+        with lease_session(config) as concurrent:
+            assert concurrent is not session
+    reused.clearcache.assert_called_once_with()
+    with lease_session(config, parse_model=False):
+        pass
+    assert session_env.call_count == 3
+
+
+def test_lease_session_invalid(session_env, config):
+    with lease_session(config) as session:
+        pass
+    session.get.side_effect = ConnectionError()
+    with lease_session(config) as replacement:
+        assert replacement is not session
+    session.disconnect.assert_called_once_with()
+
+
+def test_release_sessions(session_env, config):
+    with lease_session(config) as session:
+        pass
+    release_sessions(config)
+    session.disconnect.assert_called_once_with()
+    with lease_session(config) as replacement:
+        assert replacement is not session
@@ -1,3 +1,8 @@
+import pytest
+import yaml
+from xnat4tests.config import Config
+
+
 def test_config(config, home_dir):
 
     assert config.xnat_root_dir == home_dir / "xnat_root" / "test-config"
@@ -17,3 +22,49 @@ def test_config(config, home_dir):
     # assert config.build_args.xnat_batch_launch_plugin_version == "0.7.1"
     assert config.build_args.java_ms == "256m"
     assert config.build_args.java_mx == "1g"
+
+
+def test_config_mnt_modes():
+    config = Config(xnat_mnt_modes={"prearchive": "tmpfs:1g", "home/work": "volume"})
+    assert config.mnt_mode("prearchive") == "tmpfs"
+    assert config.mnt_mode("home/work") == "volume"
+    assert config.mnt_mode("archive") == "bind"
+    with pytest.warns(UserWarning, match="container service"):
+        Config(xnat_mnt_modes={"archive": "tmpfs"})
+    with pytest.raises(ValueError, match="mount mode"):
+        Config(xnat_mnt_modes={"archive": "nfs"})
+    with pytest.raises(ValueError, match="not one of the mounted"):
+        Config(xnat_mnt_modes={"cache": "tmpfs"})
+
+
+def test_config_load_cached(work_dir):
+    config_path = work_dir / "cached-config.yaml"
+    config_path.write_text("docker_container: first\n")
+    config = Config.load(config_path)
+    assert Config.load(config_path) == config
+    # Changes to loaded configurations don't leak into later loads
+    config.docker_container = "changed"
+    assert Config.load(config_path).docker_container == "first"
+    config_path.write_text("docker_container: second-one\n")
+    reloaded = Config.load(config_path)
+    assert reloaded.docker_container == "second-one"
+
+
+def test_config_load_legacy_paths(work_dir):
+    config_path = work_dir / "legacy-config.yaml"
+    config_path.write_text(
+        "xnat_root_dir: !!python/object/apply:pathlib.PosixPath\n"
+        f"- {work_dir}\n"
+        "- xnat_root\n"
+    )
+    assert Config.load(config_path).xnat_root_dir == work_dir / "xnat_root"
+    # Other Python-specific tags are not constructed
+    config_path.write_text("docker_image: !!python/object/apply:os.getcwd []\n")
+    with pytest.raises(yaml.constructor.ConstructorError):
+        Config.load(config_path)
+
+
+def test_config_docker_build_dir_deprecated(work_dir):
+    with pytest.warns(DeprecationWarning, match="docker_build_dir"):
+        config = Config(docker_build_dir=work_dir / "missing" / "build")
+    assert config.docker_build_dir == work_dir / "missing" / "build"
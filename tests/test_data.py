@@ -1,7 +1,12 @@
+import io
+import zipfile
+import functools
+import threading
 import pytest
 import time
 from xnat4tests.base import connect
-from xnat4tests.data import add_data
+from xnat4tests.data import add_data, write_dicom_zip, _run_uploads
+from xnat4tests.utils import PipeStream
 
 
 def test_add_data(config, launched_xnat):
@@ -73,3 +78,58 @@ def test_simple_dir(config, launched_xnat):
         assert sorted(s.type for s in xsess2.scans.values()) == [
             "a-directory",
         ]
+
+
+def test_run_uploads():
+    uploaded = []
+    lock = threading.Lock()
+
+    def upload(project_id, subject_id, session_id, fail=False):
+        if fail:
+            raise ValueError("upload failed")
+        with lock:
+            uploaded.append(session_id)
+
+    uploads = [
+        functools.partial(
+            upload, project_id="PROJ", subject_id="SUBJ", session_id=f"SESS{i}"
+        )
+        for i in range(4)
+    ]
+    _run_uploads(uploads, jobs=3)
+    assert sorted(uploaded) == ["SESS0", "SESS1", "SESS2", "SESS3"]
+
+    uploads.append(
+        functools.partial(
+            upload, project_id="PROJ", subject_id="SUBJ", session_id="BAD", fail=True
+        )
+    )
+    with pytest.raises(RuntimeError, match="1 of 5 sessions:\n    PROJ/SUBJ/BAD"):
+        _run_uploads(uploads, jobs=2)
+    assert len(uploaded) == 8
+
+
+def test_write_dicom_zip(work_dir):
+    dicom_dirs = []
+    for series in ("t1w", "fmap"):
+        series_dir = work_dir / series
+        series_dir.mkdir()
+        for i in range(3):
+            (series_dir / f"{i}.dcm").write_bytes(f"{series}-{i}".encode() * 1000)
+        dicom_dirs.append(series_dir)
+
+    with PipeStream(lambda f: write_dicom_zip(f, dicom_dirs)) as stream:
+        zipped = stream.read()
+
+    with zipfile.ZipFile(io.BytesIO(zipped)) as zfile:
+        assert sorted(zfile.namelist()) == [
+            "0/0.dcm",
+            "0/1.dcm",
+            "0/2.dcm",
+            "1/0.dcm",
+            "1/1.dcm",
+            "1/2.dcm",
+        ]
+        assert zfile.read("1/2.dcm") == b"fmap-2" * 1000
+    # Source series are left in place
+    assert sorted(p.name for p in work_dir.iterdir()) == ["fmap", "t1w"]
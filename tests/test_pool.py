@@ -0,0 +1,47 @@
+import warnings
+import attrs
+import pytest
+from xnat4tests import pool as pool_module
+from xnat4tests.pool import InstancePool
+
+
+@pytest.fixture
+def instance_pool(config, work_dir, monkeypatch):
+    monkeypatch.setattr(pool_module, "XNAT4TESTS_HOME", work_dir)
+    return InstancePool(size=3, base_config=config, name="unittest")
+
+
+def test_pool_configs(instance_pool, config):
+    configs = instance_pool.configs
+    assert len(set(c.xnat_port for c in configs)) == 3
+    assert len(set(c.docker_container for c in configs)) == 3
+    assert len(set(c.xnat_root_dir for c in configs)) == 3
+    for i, pool_config in enumerate(configs):
+        assert pool_config.docker_container == f"{config.docker_container}-unittest-{i}"
+        assert pool_config.xnat_root_dir.parent == config.xnat_root_dir.parent
+        assert pool_config.docker_image == config.docker_image
+        assert pool_config.build_args == config.build_args
+        assert instance_pool.config_path(i).exists()
+    # Allocations are reloaded from the saved configurations
+    assert [c.xnat_port for c in instance_pool.configs] == [
+        c.xnat_port for c in configs
+    ]
+
+
+@pytest.mark.parametrize(
+    "worker_id,index", [("gw0", 0), ("gw2", 2), ("gw4", 1), ("master", 0)]
+)
+def test_pool_worker_index(instance_pool, worker_id, index):
+    assert instance_pool.worker_index(worker_id) == index
+
+
+def test_pool_remote_docker_host(instance_pool, config, caplog):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        instance_pool.base_config = attrs.evolve(
+            config,
+            docker_host="remotehost",
+            build_args=attrs.asdict(config.build_args),
+        )
+    instance_pool.configs
+    assert "may clash with ports already in use on remotehost" in caplog.text
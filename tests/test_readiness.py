@@ -0,0 +1,106 @@
+import time
+import queue
+import itertools
+from unittest import mock
+import pytest
+from xnat4tests import readiness
+from xnat4tests.config import Config
+from xnat4tests.readiness import (
+    backoff_delays,
+    wait_for_http,
+    wait_for_health,
+    wait_for_logs,
+    postgres_ready_after,
+    _enqueue_lines,
+)
+
+
+def test_backoff_delays():
+
+    config = Config(connection_attempt_sleep=2)
+
+    delays = list(itertools.islice(backoff_delays(config), 10))
+
+    assert delays[0] <= 0.25
+    assert all(d <= 2 for d in delays)
+    assert delays[-1] >= 1
+
+
+def test_wait_for_http_timeout():
+
+    config = Config(docker_host="127.0.0.1", xnat_port="1", readiness_timeout=1)
+
+    with pytest.raises(TimeoutError):
+        wait_for_http(config)
+
+
+def test_enqueue_lines():
+
+    lines = queue.Queue()
+
+    _enqueue_lines(
+        [b"Postgres is up - building", b" XNAT database\nXNAT database ready\nLaunc"],
+        lines,
+    )
+
+    assert [lines.get_nowait() for _ in range(4)] == [
+        "Postgres is up - building XNAT database",
+        "XNAT database ready",
+        "Launc",
+        None,
+    ]
+
+
+def test_postgres_ready_after():
+
+    container = mock.Mock(
+        attrs={"State": {"StartedAt": "2026-10-18T10:00:00.250000123Z"}}
+    )
+    container.exec_run.return_value = mock.Mock(
+        exit_code=0,
+        output=(
+            b"2026-10-18 09:00:03.000 UTC [9] LOG:  database system is ready to "
+            b"accept connections\n"
+            b"2026-10-18 10:00:02.750 UTC [9] LOG:  database system is ready to "
+            b"accept connections\n"
+            b"2026-10-18 10:00:05.000 UTC [42] LOG:  checkpoint starting: time\n"
+        ),
+    )
+
+    assert postgres_ready_after(container) == 2.5
+
+    container.exec_run.return_value = mock.Mock(exit_code=1, output=b"")
+    assert postgres_ready_after(container) is None
+
+
+def test_wait_for_health_until_epoch():
+
+    config = Config(readiness_timeout=60)
+    container = mock.Mock(attrs={"State": {"Health": {"Status": "healthy"}}})
+
+    wait_for_health(container, config)
+
+    until = container.client.events.call_args.kwargs["until"]
+    assert isinstance(until, int)
+    assert time.time() + 55 < until <= time.time() + 61
+
+
+@pytest.mark.parametrize("already_up", [True, False])
+def test_wait_for_logs_new_lines_only(monkeypatch, already_up):
+
+    config = Config(readiness_timeout=10)
+    monkeypatch.setattr(readiness, "probe", lambda config: already_up)
+    container = mock.Mock(status="running")
+    container.logs.return_value = mock.MagicMock()
+    container.exec_run.return_value = mock.Mock(
+        output=[b"Postgres is up\n", b"INFO Server startup in [1000] milliseconds\n"]
+    )
+
+    phases = wait_for_logs(container, config)
+
+    # Lines from previous boots aren't re-read
+    tail_cmd = container.exec_run.call_args_list[0].args[0][-1]
+    assert "tail -n 0 -F" in tail_cmd
+    assert "since" in container.logs.call_args.kwargs
+    assert "tomcat_started" in phases
+    assert ("postgres_up" in phases) != already_up
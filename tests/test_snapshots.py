@@ -0,0 +1,113 @@
+import os
+import json
+from unittest import mock
+import pytest
+from xnat4tests import snapshots
+from xnat4tests.cli import cli as x4t_cli
+from xnat4tests.config import Config
+from xnat4tests.snapshots import copy_tree, snapshot_xnat, METADATA_FILE
+
+
+@pytest.fixture
+def src_tree(work_dir):
+    src = work_dir / "src"
+    (src / "proj" / "subj").mkdir(parents=True)
+    (src / "proj" / "subj" / "scan.dcm").write_bytes(b"dicom")
+    (src / "top.txt").write_text("top")
+    os.symlink("top.txt", src / "link.txt")
+    return src
+
+
+@pytest.mark.parametrize("method", ["auto", "copy", "hardlink"])
+def test_copy_tree(src_tree, work_dir, method):
+    dest = work_dir / "dest"
+    dest.mkdir()
+    used = copy_tree(src_tree, dest, method)
+    assert used in ("reflink", "copy") if method == "auto" else used == method
+    assert (dest / "proj" / "subj" / "scan.dcm").read_bytes() == b"dicom"
+    assert (dest / "top.txt").read_text() == "top"
+    assert os.readlink(dest / "link.txt") == "top.txt"
+    linked = (dest / "top.txt").stat().st_ino == (src_tree / "top.txt").stat().st_ino
+    assert linked == (method == "hardlink")
+
+
+def test_copy_tree_hardlink_not_permitted(src_tree, work_dir, monkeypatch):
+    dest = work_dir / "dest"
+    dest.mkdir()
+
+    def refuse_link(src, dst):
+        raise PermissionError(1, "Operation not permitted")
+
+    # As for root-owned files when fs.protected_hardlinks is set
+    monkeypatch.setattr(os, "link", refuse_link)
+    assert copy_tree(src_tree, dest, "hardlink") == "hardlink"
+    assert (dest / "proj" / "subj" / "scan.dcm").read_bytes() == b"dicom"
+    assert (dest / "top.txt").read_text() == "top"
+
+
+def test_snapshots_cli(work_dir, cli_runner):
+    config_path = work_dir / "snapshots-config.yaml"
+    config_path.write_text(f"snapshots_dir: {work_dir / 'snapshots'}\n")
+    config = Config.load(config_path)
+    for name in ("seeded", "empty"):
+        snapshot_dir = config.snapshots_dir / config.docker_container / name
+        snapshot_dir.mkdir(parents=True)
+        (snapshot_dir / METADATA_FILE).write_text("{}")
+    # Incomplete snapshots aren't listed
+    (config.snapshots_dir / config.docker_container / "partial").mkdir()
+
+    result = cli_runner(x4t_cli, ["-c", str(config_path), "snapshots"])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["empty", "seeded"]
+
+
+def test_snapshot_methods_per_dir(work_dir, monkeypatch):
+    xnat_root = work_dir / "xnat_root"
+    for dname in ("archive", "prearchive"):
+        (xnat_root / dname).mkdir(parents=True)
+        (xnat_root / dname / "file.txt").write_text(dname)
+    config = Config(
+        xnat_root_dir=xnat_root,
+        xnat_mnt_dirs=["archive", "prearchive", "build"],
+        xnat_mnt_modes={"build": "tmpfs"},
+        snapshots_dir=work_dir / "snapshots",
+    )
+    container = mock.Mock()
+    container.image.id = "sha256:0123"
+    monkeypatch.setattr(snapshots, "_get_container", lambda config: container)
+    monkeypatch.setattr(snapshots, "_dump_database", mock.Mock())
+    monkeypatch.setattr(snapshots, "_archive_dir", mock.Mock())
+    # Only some of the directories can be cloned, e.g. if they are on different
+    # filesystems
+    monkeypatch.setattr(
+        snapshots,
+        "copy_tree",
+        lambda src, dest, method: "reflink" if src.name == "archive" else "copy",
+    )
+
+    snapshot_dir = snapshot_xnat("seeded", config, method="auto")
+
+    with open(snapshot_dir / METADATA_FILE) as f:
+        metadata = json.load(f)
+    assert metadata["methods"] == {
+        "archive": "reflink",
+        "prearchive": "copy",
+        "build": "archive",
+    }
+
+
+def test_dump_database_failed(work_dir):
+    container = mock.Mock()
+    container.name = "xnat4tests"
+    api = container.client.api
+    api.exec_create.return_value = {"Id": "exec"}
+    api.exec_start.return_value = iter(
+        [(b"partial", None), (None, b'pg_dump: error: database "xnat" does not exist')]
+    )
+    api.exec_inspect.return_value = {"ExitCode": 1}
+
+    with pytest.raises(RuntimeError, match='database "xnat" does not exist'):
+        snapshots._dump_database(container, work_dir / "xnat.dump")
+
+    assert (work_dir / "xnat.dump").read_bytes() == b"partial"
@@ -0,0 +1,33 @@
+from unittest import mock
+import pytest
+from xnat4tests.testing import _is_unhealthy
+
+
+def test_plugin_xnat_config(pytester, config):
+    pytester.makepyfile(
+        f"""
+        def test_config(xnat_config):
+            assert xnat_config.docker_container == "{config.docker_container}"
+            assert xnat_config.xnat_port == "{config.xnat_port}"
+        """
+    )
+    result = pytester.runpytest(
+        "-p", "xnat4tests.testing", "--xnat-config", str(config.loaded_from)
+    )
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize(
+    "status,health,unhealthy",
+    [
+        ("running", None, False),
+        ("running", {"Status": "healthy"}, False),
+        ("running", {"Status": "starting"}, False),
+        ("running", {"Status": "unhealthy"}, True),
+        ("exited", None, True),
+    ],
+)
+def test_is_unhealthy(status, health, unhealthy):
+    state = {"Health": health} if health else {}
+    container = mock.Mock(status=status, attrs={"State": state})
+    assert _is_unhealthy(container) == unhealthy
@@ -0,0 +1,26 @@
+from xnat4tests.config import Config
+from xnat4tests.timing import StartupTimer, load_history, summarise
+
+
+def test_startup_history(home_dir):
+
+    config = Config(
+        docker_container="xnat4tests_timing",
+        reports_dir=home_dir / "timing-reports",
+    )
+
+    for i in range(10):
+        timer = StartupTimer()
+        timer.add("image", i)
+        timer.add("xnat_ready", 10 * i)
+        timer.write(config, relaunched=True)
+
+    history = load_history(config)
+    assert len(history) == 10
+    assert history[0]["relaunched"]
+    assert len(load_history(config, last=3)) == 3
+
+    summary = summarise(history)
+    assert summary["image"] == {"n": 10, "p50": 4, "p90": 8, "p99": 9}
+    assert summary["xnat_ready"]["p50"] == 40
+    assert summary["total"]["n"] == 10
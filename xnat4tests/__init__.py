@@ -1,7 +1,17 @@
-from .base import start_xnat, stop_xnat, restart_xnat, connect
+from .base import start_xnat, stop_xnat, restart_xnat, reset_xnat, connect
 from .registry import start_registry, stop_registry
 from .data import add_data
+from .pool import InstancePool
+from .snapshots import snapshot_xnat, restore_snapshot, list_snapshots
+from .aio import (
+    async_start_xnat,
+    async_stop_xnat,
+    async_restart_xnat,
+    async_reset_xnat,
+    async_add_data,
+)
 from .config import Config
+from .clients import docker_client, set_docker_client, lease_session
 from . import _version
 
 
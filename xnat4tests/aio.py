@@ -0,0 +1,137 @@
+"""Asyncio versions of the functions that control the life-cycle of the test XNAT
+instance. Blocking Docker and XNAT calls are run in the event loop's default executor
+and readiness probes are spaced out with async sleeps, so several instances can be
+brought up (or an image built while test data is generated) from a single event loop
+"""
+import asyncio
+import time
+import functools
+import typing as ty
+from .utils import logger
+from .config import Config
+from .base import (
+    stop_xnat,
+    restart_xnat,
+    reset_xnat,
+    _launch_container,
+    _wait_until_ready,
+    _record_wait,
+    _initialise,
+)
+from .data import add_data
+from .readiness import backoff_delays, probe, readiness_deadline
+from .timing import StartupTimer
+
+
+async def async_start_xnat(
+    config_name: ty.Union[str, Config] = "default",
+    keep_mounts: bool = False,
+    rebuild: bool = True,
+    relaunch: bool = False,
+    warm_snapshot: bool = False,
+):
+    """Asyncio version of start_xnat, see its docstring for details of the
+    parameters"""
+    timer = StartupTimer()
+
+    with timer.phase("config_load"):
+        config = await _run(Config.load, config_name)
+
+    launched = await _run(
+        _launch_container,
+        config,
+        timer,
+        keep_mounts=keep_mounts,
+        rebuild=rebuild,
+        relaunch=relaunch,
+        warm_snapshot=warm_snapshot,
+    )
+
+    logger.info("Waiting for %s to be ready", config.xnat_uri)
+    if config.readiness_check == "probe":
+        start = time.monotonic()
+        await async_wait_for_http(config)
+        await _run(
+            _record_wait,
+            launched.container,
+            timer,
+            time.monotonic() - start,
+            launched.relaunched,
+        )
+    else:
+        # The other readiness checks block on streams from the Docker daemon rather
+        # than polling so can just be run in the executor
+        await _run(
+            _wait_until_ready, launched.container, config, timer, launched.relaunched
+        )
+
+    await _run(_initialise, launched, config, timer)
+
+    return launched.container
+
+
+async def async_stop_xnat(
+    config_name: ty.Union[str, Config] = "default", wait: bool = False
+):
+    """Asyncio version of stop_xnat"""
+    await _run(stop_xnat, config_name, wait=wait)
+
+
+async def async_restart_xnat(config_name: ty.Union[str, Config] = "default"):
+    """Asyncio version of restart_xnat"""
+    await _run(restart_xnat, config_name)
+
+
+async def async_reset_xnat(config_name: ty.Union[str, Config] = "default"):
+    """Asyncio version of reset_xnat"""
+    await _run(reset_xnat, config_name)
+
+
+async def async_add_data(
+    dataset: str,
+    config_name: ty.Union[str, Config] = "default",
+    upload_method: str = "direct-archive",
+    jobs: int = 1,
+):
+    """Asyncio version of add_data, see its docstring for details of the
+    parameters"""
+    await _run(
+        add_data,
+        dataset,
+        config_name=config_name,
+        upload_method=upload_method,
+        jobs=jobs,
+    )
+
+
+async def async_wait_for_http(config: Config):
+    """Asyncio version of readiness.wait_for_http, which probes XNAT in the executor
+    and sleeps between probes without blocking the event loop
+
+    Parameters
+    ----------
+    config : Config
+        the configuration of the XNAT instance to wait on
+
+    Raises
+    ------
+    TimeoutError
+        if XNAT isn't ready before the readiness timeout
+    """
+    deadline = readiness_deadline(config)
+    for attempt, delay in enumerate(backoff_delays(config), start=1):
+        if await _run(probe, config):
+            logger.debug("%s ready after %d probes", config.xnat_uri, attempt)
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"XNAT at {config.xnat_uri} was not ready after {attempt} probes"
+            )
+        await asyncio.sleep(min(delay, remaining))
+
+
+async def _run(func, *args, **kwargs):
+    """Runs a blocking function in the default executor of the running loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,114 @@
+import os
+import hashlib
+import tempfile
+import typing as ty
+from pathlib import Path
+import attrs
+import requests
+from .utils import logger
+from .config import Config
+
+
+# The XNAT web-app and plugins that are installed into the image. Each is mapped
+# from the name of the file it is placed at within the build context to the
+# build arg that holds its version and the template of the URL to download it from
+ARTIFACTS = {
+    "xnat-web.war": (
+        "xnat_version",
+        "https://api.bitbucket.org/2.0/repositories/xnatdev/xnat-web/downloads/"
+        "xnat-web-{version}.war",
+    ),
+    "container-service-plugin.jar": (
+        "xnat_cs_plugin_version",
+        "https://api.bitbucket.org/2.0/repositories/xnatdev/container-service/"
+        "downloads/container-service-{version}-fat.jar",
+    ),
+    "batch-launch-plugin.jar": (
+        "xnat_batch_launch_plugin_version",
+        "https://api.bitbucket.org/2.0/repositories/xnatx/xnatx-batch-launch-plugin/"
+        "downloads/batch-launch-{version}.jar",
+    ),
+}
+
+CHECKSUM_EXT = ".sha256"
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+
+def fetch_artifacts(config: Config) -> ty.Dict[str, Path]:
+    """Ensures the XNAT web-app and plugin versions specified in the build args are
+    present in the local artifact store, downloading them if they are missing or if
+    they don't match the checksum recorded when they were downloaded
+
+    Parameters
+    ----------
+    config : Config
+        the configuration specifying the artifact store location and build args
+
+    Returns
+    -------
+    dict[str, Path]
+        the cached artifacts, mapped from the names they are given in the build
+        context
+    """
+    build_args = attrs.asdict(config.build_args)
+    artifacts = {}
+    for name, (version_arg, url_template) in ARTIFACTS.items():
+        version = build_args[version_arg]
+        url = url_template.format(version=version)
+        stem = Path(name).stem
+        cached = config.artifacts_dir / stem / version / url.split("/")[-1]
+        if not _verify(cached):
+            _download(url, cached)
+        else:
+            logger.debug("Using cached %s %s from '%s'", stem, version, str(cached))
+        artifacts[name] = cached
+    return artifacts
+
+
+def _verify(path: Path) -> bool:
+    """Checks that the artifact exists and matches its recorded checksum"""
+    checksum_path = path.with_name(path.name + CHECKSUM_EXT)
+    if not path.exists() or not checksum_path.exists():
+        return False
+    if _sha256(path) != checksum_path.read_text().split()[0]:
+        logger.warning("Cached artifact '%s' is corrupted, downloading again", path)
+        return False
+    return True
+
+
+def _download(url: str, path: Path):
+    """Downloads the artifact into the store via a temporary file, so concurrent
+    builds don't see partially downloaded artifacts, and records its checksum"""
+    logger.info("Downloading %s to local artifact store", url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    hsh = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".download-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            try:
+                response = requests.get(url, stream=True, timeout=60)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                raise RuntimeError(
+                    f"Could not download '{url}' into the artifact store at "
+                    f"'{str(path.parent)}' and it is not already cached: {e}"
+                )
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                hsh.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    path.with_name(path.name + CHECKSUM_EXT).write_text(
+        f"{hsh.hexdigest()}  {path.name}\n"
+    )
+
+
+def _sha256(path: Path) -> str:
+    hsh = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hsh.update(chunk)
+    return hsh.hexdigest()
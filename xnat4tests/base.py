@@ -1,26 +1,43 @@
 import stat
-import shutil
 import time
-import requests
-from pathlib import Path
+import shutil
+import typing as ty
 import attrs
+import requests
 import docker
 from .utils import logger
-import xnat
 from .config import Config
-
-
-SRC_DIR = Path(__file__).parent / "docker-src"
-
-
-def start_xnat(config_name="default", keep_mounts=False, rebuild=True, relaunch=False):
+from .clients import docker_client, new_session, release_sessions
+from .readiness import (
+    wait_for_health,
+    wait_for_http,
+    wait_for_logs,
+    postgres_ready_after,
+)
+from .build import build_image, warm_image_tag, WARM_SNAPSHOT_LABEL
+from .timing import StartupTimer
+
+
+STOP_TIMEOUT = 120
+# Script within the image that resets XNAT (and takes the template to reset it from)
+RESET_SCRIPT = "/usr/local/bin/reset-xnat.sh"
+
+
+def start_xnat(
+    config_name="default",
+    keep_mounts=False,
+    rebuild=True,
+    relaunch=False,
+    warm_snapshot=False,
+):
     """Starts an XNAT repository within a single Docker container that has
     has the container service plugin configured to access the Docker socket
     to launch sibling containers.
 
     Directories listed in "xnat_mnt_dirs" are mounted from the host machine at
     "xnat_root" for convenience and to facilitate methods that mock the
-    environment containers run in within the XNAT container service.
+    environment containers run in within the XNAT container service, unless they are
+    set to be mounted from Docker volumes or in memory (tmpfs) in "xnat_mnt_modes".
 
     Parameters
     ----------
@@ -35,63 +52,96 @@ def start_xnat(config_name="default", keep_mounts=False, rebuild=True, relaunch=
         in the archive directory as otherwise it won't match up with the Postgres DB
         within the container
     rebuild : bool
-        rebuild the Docker image whether a matching image exists or not
+        rebuild the Docker image if the Docker sources or build arguments have changed
+        since it was last built. If false, any existing image with the configured name
+        is used as is
     relaunch : bool
         relaunch the container whether a matching container exists or not
+    warm_snapshot : bool
+        launch the container from a "warm" snapshot of a previously initialised
+        container if one matching the build fingerprint and configuration exists,
+        otherwise commit the container to a warm snapshot once it has been initialised
+        and configured. Containers launched from warm snapshots skip XNAT's first-boot
+        database initialisation and container service configuration
     """
 
-    config = Config.load(config_name)
+    timer = StartupTimer()
 
-    dc = docker.from_env()
+    with timer.phase("config_load"):
+        config = Config.load(config_name)
 
-    if rebuild:
-        config.docker_build_dir.parent.mkdir(exist_ok=True, parents=True)
-        if config.docker_build_dir.exists():
-            shutil.rmtree(config.docker_build_dir, ignore_errors=True)
-        logger.info(
-            "Building %s in '%s' directory",
-            config.docker_image,
-            str(config.docker_build_dir),
-        )
-        shutil.copytree(SRC_DIR, config.docker_build_dir)
-        try:
-            image, _ = dc.images.build(
-                path=str(config.docker_build_dir),
-                tag=config.docker_image,
-                buildargs={
-                    k.upper(): v for k, v in attrs.asdict(config.build_args).items()
-                },
-            )
-        except docker.errors.BuildError as e:
-            build_log = "\n".join(ln.get("stream", "") for ln in e.build_log)
-            raise RuntimeError(
-                f"Building '{config.docker_image}' in '{str(config.docker_build_dir)}' "
-                f"failed with the following errors:\n\n{build_log}"
-            )
-        logger.info("Built %s successfully", config.docker_image)
-    else:
-        try:
-            image = dc.images.get(config.docker_image)
-        except docker.errors.ImageNotFound:
-            rebuild = True
+    launched = _launch_container(
+        config,
+        timer,
+        keep_mounts=keep_mounts,
+        rebuild=rebuild,
+        relaunch=relaunch,
+        warm_snapshot=warm_snapshot,
+    )
+
+    # Need to give time for XNAT to get itself ready after it has started so we
+    # wait until it is up before logging in
+    logger.info("Waiting for %s to be ready", config.xnat_uri)
+    _wait_until_ready(launched.container, config, timer, launched.relaunched)
+
+    _initialise(launched, config, timer)
+
+    return launched.container
+
+
+@attrs.define
+class _Launched:
+    """The outcome of launching (or reusing) the XNAT container"""
+
+    container: docker.models.containers.Container
+    relaunched: bool
+    warm_tag: ty.Optional[str] = None  # tag to commit a warm snapshot to
+    from_warm_snapshot: bool = False
+
+
+def _launch_container(
+    config: Config, timer: StartupTimer, keep_mounts, rebuild, relaunch, warm_snapshot
+) -> _Launched:
+    """Builds or looks up the image and launches the container (or finds the
+    existing one), the first stage of start_xnat"""
+
+    dc = docker_client(config)
+
+    with timer.phase("image"):
+        if rebuild:
+            image = build_image(config, dc)
+        else:
+            try:
+                image = dc.images.get(config.docker_image)
+            except docker.errors.ImageNotFound:
+                image = build_image(config, dc)
+
+        warm_image = None
+        if warm_snapshot:
+            warm_tag = warm_image_tag(config, image)
+            try:
+                warm_image = dc.images.get(f"{config.docker_image}:{warm_tag}")
+            except docker.errors.ImageNotFound:
+                logger.info("Did not find warm snapshot of %s", config.docker_image)
+            else:
+                logger.info("Found warm snapshot %s:%s", config.docker_image, warm_tag)
+        launch_image = warm_image if warm_image is not None else image
 
     try:
         container = dc.containers.get(config.docker_container)
     except docker.errors.NotFound:
         relaunch = True
     else:
-        if relaunch or container.image != image:
+        if relaunch or container.image not in (image, warm_image):
             logger.info("Stopping existing %s container", config.docker_container)
-            container.stop()
-            while config.docker_container in (c.name for c in dc.containers.list()):
-                logger.info(
-                    "Waiting for %s container to be autoremoved",
-                    config.docker_container,
-                )
+            with timer.phase("container_stop"):
+                stop_container(container, wait_for_removal=True)
             relaunch = True
 
     if relaunch:
         logger.info("Did not find %s container, relaunching", config.docker_container)
+        # Sessions with the previous container are no longer valid
+        release_sessions(config)
         volumes = {
             "/var/run/docker.sock": {"bind": "/var/run/docker.sock", "mode": "rw"}
         }
@@ -104,7 +154,23 @@ def start_xnat(config_name="default", keep_mounts=False, rebuild=True, relaunch=
                 shutil.rmtree(config.xnat_root_dir, ignore_errors=True)
             except FileNotFoundError:
                 pass
+        tmpfs = {}
         for dname in config.xnat_mnt_dirs:
+            mode = config.mnt_mode(dname)
+            if mode == "tmpfs":
+                tmpfs["/data/xnat/" + dname] = _tmpfs_options(
+                    config.xnat_mnt_modes[dname]
+                )
+                continue
+            elif mode == "volume":
+                volume_name = mnt_volume_name(config, dname)
+                if not keep_mounts:
+                    try:
+                        dc.volumes.get(volume_name).remove()
+                    except docker.errors.NotFound:
+                        pass
+                volumes[volume_name] = {"bind": "/data/xnat/" + dname, "mode": "rw"}
+                continue
             dpath = config.xnat_root_dir / dname
             dpath.mkdir(parents=True, exist_ok=True)
             # Set set-group-ID bit so sub-directories (created by root in
@@ -122,101 +188,291 @@ def start_xnat(config_name="default", keep_mounts=False, rebuild=True, relaunch=
             )
             volumes[str(dpath)] = {"bind": "/data/xnat/" + dname, "mode": "rw"}
 
-        container = dc.containers.run(
-            image.tags[0],
-            detach=True,
-            ports={"8080/tcp": config.xnat_port},
-            remove=True,
-            name=config.docker_container,
-            # Expose the XNAT archive dir outside of the XNAT docker container
-            # to simulate what the XNAT container service exposes to running
-            # pipelines, and the Docker socket for the container service to
-            # to use
-            network=docker_network().id,
-            volumes=volumes,
-        )
+        with timer.phase("network"):
+            network = docker_network(config)
+
+        with timer.phase("container_run"):
+            container = dc.containers.run(
+                launch_image.tags[0],
+                detach=True,
+                ports={"8080/tcp": config.xnat_port},
+                remove=True,
+                name=config.docker_container,
+                # Expose the XNAT archive dir outside of the XNAT docker container
+                # to simulate what the XNAT container service exposes to running
+                # pipelines, and the Docker socket for the container service to
+                # to use
+                network=network.id,
+                volumes=volumes,
+                tmpfs=tmpfs,
+            )
         logger.info("%s launched successfully", config.docker_container)
     else:
         logger.info("Found existing %s container, reusing", config.docker_container)
 
-    # Need to give time for XNAT to get itself ready after it has
-    # started so we try multiple times until giving up trying to connect
-    logger.info("Attempting to connect to %s", config.xnat_uri)
-    for attempts in range(1, config.connection_attempts + 1):
-        try:
-            login = connect(config)
-        except (xnat.exceptions.XNATError, requests.ConnectionError, requests.ReadTimeout):
-            if attempts == config.connection_attempts:
-                raise
-            else:
-                logger.debug(
-                    "Attempt %d/%d to connect to %s failed, retrying",
-                    attempts,
-                    config.connection_attempts,
-                    config.xnat_uri,
-                )
-                time.sleep(config.connection_attempt_sleep)
+    return _Launched(
+        container=container,
+        relaunched=relaunch,
+        warm_tag=warm_tag if warm_snapshot else None,
+        from_warm_snapshot=warm_image is not None,
+    )
+
+
+def _wait_until_ready(
+    container, config: Config, timer: StartupTimer, relaunched: bool = True
+):
+    """Waits for XNAT to be ready using the configured readiness check, recording the
+    wait split into the time until Postgres was up and the time from then until
+    Tomcat had started"""
+    if config.readiness_check == "logs":
+        startup = wait_for_logs(container, config)
+        _record_wait(
+            container,
+            timer,
+            startup["tomcat_started"],
+            relaunched,
+            postgres_up=startup.get("postgres_up"),
+        )
+    else:
+        start = time.monotonic()
+        if config.readiness_check == "health":
+            wait_for_health(container, config)
         else:
-            break
+            wait_for_http(config)
+        _record_wait(container, timer, time.monotonic() - start, relaunched)
+
+
+def _record_wait(
+    container,
+    timer: StartupTimer,
+    waited: float,
+    relaunched: bool,
+    postgres_up: ty.Optional[float] = None,
+):
+    """Records the wait for XNAT to be ready, split into the time until Postgres was
+    up and the time from then until Tomcat had started if the container has just been
+    launched, otherwise as a single "xnat_ready" phase. If when Postgres was up wasn't
+    seen in the logs, it is read from the timestamps in the Postgres log"""
+    if not relaunched:
+        timer.add("xnat_ready", waited)
+        return
+    if postgres_up is None:
+        postgres_up = postgres_ready_after(container)
+    if postgres_up is None:
+        timer.add("xnat_ready", waited)
+        return
+    postgres_up = min(postgres_up, waited)
+    timer.add("postgres_ready", postgres_up)
+    timer.add("tomcat_ready", waited - postgres_up)
+
+
+def _initialise(launched: _Launched, config: Config, timer: StartupTimer):
+    """Logs into XNAT and configures the container service of freshly launched
+    instances, then records the startup timings, the final stage of start_xnat"""
+    container = launched.container
+
+    with timer.phase("first_login"):
+        login = connect(config)
     logger.info("Connected to %s successfully", config.xnat_uri)
 
-    if relaunch:
-        # Set the path translations to point to the mounted XNAT home directory
-        with login:
-            if "containers" in login.get("/xapi/plugins").json():
-                logger.info("Configuing docker server for container service")
-                login.post(
-                    "/xapi/docker/server",
-                    json={
-                        # 'id': 2,
-                        "name": "Local socket",
-                        "host": "unix:///var/run/docker.sock",
-                        "cert-path": "",
-                        "swarm-mode": False,
-                        "path-translation-xnat-prefix": "/data/xnat",
-                        "path-translation-docker-prefix": str(config.xnat_root_dir),
-                        "pull-images-on-xnat-init": False,
-                        "container-user": "",
-                        "auto-cleanup": True,
-                        "swarm-constraints": [],
-                        "ping": True,
-                    },
+    if launched.relaunched and not launched.from_warm_snapshot:
+        with login, timer.phase("container_service_config"):
+            _configure_container_service(login, config)
+        if config.reset_template:
+            # Now that XNAT has initialised its database schema, take the template
+            # that reset_xnat recreates the database from (before any warm snapshot
+            # is committed so that it is included in it)
+            with timer.phase("reset_template"):
+                _take_reset_template(container, config)
+        if launched.warm_tag:
+            logger.info(
+                "Committing initialised %s container to warm snapshot %s:%s",
+                config.docker_container,
+                config.docker_image,
+                launched.warm_tag,
+            )
+            with timer.phase("warm_snapshot"):
+                container.commit(
+                    repository=config.docker_image,
+                    tag=launched.warm_tag,
+                    changes=[f"LABEL {WARM_SNAPSHOT_LABEL}={config.docker_container}"],
                 )
+                _remove_stale_warm_snapshots(container, config, launched.warm_tag)
+
+    timer.write(
+        config,
+        relaunched=launched.relaunched,
+        warm_snapshot=launched.from_warm_snapshot,
+        readiness_check=config.readiness_check,
+    )
+
+
+def _remove_stale_warm_snapshots(container, config: Config, warm_tag: str):
+    """Removes the warm snapshots of the container that were committed before the one
+    just committed to "warm_tag", i.e. for previous builds of the image or
+    configurations, so that they don't accumulate"""
+    keep = f"{config.docker_image}:{warm_tag}"
+    images = container.client.images
+    for image in images.list(
+        name=config.docker_image,
+        filters={"label": f"{WARM_SNAPSHOT_LABEL}={config.docker_container}"},
+    ):
+        if keep in image.tags:
+            continue
+        for tag in image.tags:
+            if tag.rsplit(":", 1)[0] != config.docker_image:
+                continue  # tagged into another repository by the user
+            logger.info("Removing stale warm snapshot %s", tag)
+            try:
+                images.remove(tag)
+            except docker.errors.APIError as e:
+                # e.g. if another container was launched from it
+                logger.warning("Could not remove warm snapshot %s: %s", tag, e)
+
+
+def _take_reset_template(container, config: Config):
+    """Saves a template of the initialised XNAT database within the container for
+    reset_xnat to recreate the database from. Failures are only logged, as the
+    instance is still usable without it (e.g. when launched from an image built by an
+    older version, which doesn't contain the reset script)"""
+    logger.info("Taking template of XNAT database in %s", config.docker_container)
+    try:
+        result = container.exec_run([RESET_SCRIPT, "-t"])
+    except docker.errors.APIError as e:
+        output, failed = str(e), True
+    else:
+        output, failed = result.output.decode(errors="replace"), result.exit_code
+    if failed:
+        logger.warning(
+            "Could not take template of XNAT database in %s, so it can't be reset "
+            "with reset_xnat:\n\n%s",
+            config.docker_container,
+            output,
+        )
 
-    return container
 
+def _configure_container_service(login, config: Config):
+    """Sets the path translations of the container service to point to the mounted
+    XNAT root directory"""
+    if "containers" in login.get("/xapi/plugins").json():
+        logger.info("Configuing docker server for container service")
+        login.post(
+            "/xapi/docker/server",
+            json={
+                # 'id': 2,
+                "name": "Local socket",
+                "host": "unix:///var/run/docker.sock",
+                "cert-path": "",
+                "swarm-mode": False,
+                "path-translation-xnat-prefix": "/data/xnat",
+                "path-translation-docker-prefix": str(config.xnat_root_dir),
+                "pull-images-on-xnat-init": False,
+                "container-user": "",
+                "auto-cleanup": True,
+                "swarm-constraints": [],
+                "ping": True,
+            },
+        )
+
+
+def stop_xnat(config_name="default", wait=False):
+    """Stops the test XNAT container, which is then removed automatically
 
-def stop_xnat(config_name="default"):
+    Parameters
+    ----------
+    config_name : str or Config
+        the configuration (or name of the configuration file) of the instance to stop
+    wait : bool
+        wait until the container has been removed so that its name can be reused
+    """
 
     config = Config.load(config_name)
 
-    dc = docker.from_env()
+    dc = docker_client(config)
     try:
         container = dc.containers.get(config.docker_container)
     except docker.errors.NotFound:
         logger.info("Test XNAT was not running at %s", config.docker_container)
     else:
         logger.info("Stopping test XNAT running at %s", config.docker_container)
-        container.stop()
+        release_sessions(config)
+        stop_container(container, wait_for_removal=wait)
 
 
 def restart_xnat(config_name="default"):
+    """Restarts the test XNAT container in place (it isn't removed in between, so
+    there is nothing to wait on before Docker's restart returns)"""
 
     config = Config.load(config_name)
 
-    dc = docker.from_env()
+    dc = docker_client(config)
     try:
         container = dc.containers.get(config.docker_container)
     except docker.errors.NotFound:
         raise Exception("Test XNAT was not running at %s", config.docker_container)
+    release_sessions(config)
     container.restart()
 
 
+def reset_xnat(config_name="default"):
+    """Resets the running test XNAT instance to the state it was in when its container
+    was launched, without relaunching the container. Tomcat is stopped, the XNAT
+    database is recreated from the template taken by start_xnat once XNAT had
+    initialised its schema, the archive, prearchive, build and cache directories are
+    cleared and Tomcat is started again. Postgres and the container keep running, and
+    as the schema is already initialised, the reset takes about as long as Tomcat
+    takes to start on an existing database.
+
+    The template is only taken if "reset_template" is set in the configuration when
+    the instance is launched, as it adds a database dump to the startup
+
+    Note that registries added with start_registry need to be added again afterwards
+
+    Parameters
+    ----------
+    config_name : str or Config
+        the configuration (or name of the configuration file) of the instance to reset
+
+    Raises
+    ------
+    RuntimeError
+        if the reset script fails within the container, or no template was taken
+    """
+    config = Config.load(config_name)
+
+    dc = docker_client(config)
+    try:
+        container = dc.containers.get(config.docker_container)
+    except docker.errors.NotFound:
+        raise RuntimeError(f"Test XNAT was not running at {config.xnat_uri}")
+
+    logger.info("Resetting test XNAT running at %s", config.docker_container)
+    release_sessions(config)
+    result = container.exec_run([RESET_SCRIPT])
+    output = result.output.decode(errors="replace")
+    if result.exit_code in (126, 127) or "No template" in output:
+        raise RuntimeError(
+            f"No template of the XNAT database has been taken in "
+            f"{config.docker_container} to reset it from. Set 'reset_template: true' "
+            "in the configuration and relaunch the instance (rebuilding its image if "
+            "it was built by an older version of xnat4tests)"
+        )
+    elif result.exit_code:
+        raise RuntimeError(
+            f"Failed to reset XNAT in {config.docker_container}:\n\n" + output
+        )
+    # The health status lags behind Tomcat restarting so probe XNAT directly
+    wait_for_http(config)
+    with connect(config) as login:
+        _configure_container_service(login, config)
+    logger.info("Reset test XNAT running at %s", config.docker_container)
+
+
 def docker_network(config_name="default"):
 
     config = Config.load(config_name)
 
-    dc = docker.from_env()
+    dc = docker_client(config)
     try:
         network = dc.networks.get(config.docker_network_name)
     except docker.errors.NotFound:
@@ -224,9 +480,72 @@ def docker_network(config_name="default"):
     return network
 
 
-def connect(config_name="default"):
+def connect(config_name="default", parse_model=True):
+    """Logs into the test XNAT instance, returning a new session that should be
+    disconnected (e.g. by using it as a context manager) when it is no longer needed.
+    Use clients.lease_session to reuse sessions between calls instead
 
+    Parameters
+    ----------
+    config_name : str or Config
+        the configuration (or name of the configuration file) of the instance
+    parse_model : bool
+        whether to parse the XNAT data model on connection, which can be skipped when
+        only making raw REST calls
+    """
     config = Config.load(config_name)
 
-    logger.info("Connecting to %s as '%s'", config.xnat_uri, "admin")
-    return xnat.connect(config.xnat_uri, user="admin", password="admin")
+    return new_session(config, parse_model=parse_model)
+
+
+def mnt_volume_name(config: Config, dname: str) -> str:
+    """Returns the name of the Docker volume that a directory with the "volume" mount
+    mode is stored in"""
+    return f"{config.docker_container}-{dname.replace('/', '-')}"
+
+
+def _tmpfs_options(mode: str) -> str:
+    """Converts a "tmpfs[:size]" mount mode into the options of the tmpfs mount"""
+    _, _, size = mode.partition(":")
+    return f"size={size}" if size else ""
+
+
+def stop_container(
+    container: docker.models.containers.Container,
+    wait_for_removal: bool = False,
+    timeout: float = STOP_TIMEOUT,
+):
+    """Stops a container and waits until it has stopped, and optionally until it has
+    been (auto-)removed, by blocking on the Docker daemon's wait endpoint rather than
+    polling
+
+    Parameters
+    ----------
+    container : docker.models.containers.Container
+        the container to stop
+    wait_for_removal : bool
+        wait until the container has been removed too. Only applies to containers
+        launched with auto-remove, otherwise it just waits for the container to stop
+    timeout : float
+        the maximum number of seconds to wait
+
+    Raises
+    ------
+    TimeoutError
+        if the container isn't stopped (or removed) within the timeout
+    """
+    try:
+        auto_remove = container.attrs["HostConfig"].get("AutoRemove", False)
+        container.stop()
+        logger.debug("Waiting for %s container to be removed", container.name)
+        container.wait(
+            condition="removed" if wait_for_removal and auto_remove else "not-running",
+            timeout=timeout,
+        )
+    except docker.errors.NotFound:
+        pass  # Container has already been removed
+    except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout):
+        raise TimeoutError(
+            f"{container.name} container was not "
+            f"{'removed' if wait_for_removal else 'stopped'} within {timeout}s"
+        )
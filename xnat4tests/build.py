@@ -0,0 +1,307 @@
+import io
+import re
+import time
+import hashlib
+import json
+import tarfile
+import typing as ty
+from datetime import datetime
+from pathlib import Path
+import attrs
+import docker
+from .utils import logger, PipeStream
+from .config import Config
+from .artifacts import fetch_artifacts
+
+
+SRC_DIR = Path(__file__).parent / "docker-src"
+
+# Matches the lines that the (classic) Docker builder outputs at the start of each
+# step and on success
+BUILD_STEP_RE = re.compile(r"Step (\d+)/\d+ : (.*)")
+BUILD_SUCCESS_RE = re.compile(r"Successfully built ([0-9a-f]+)")
+# ID of the progress messages streamed by BuildKit, which aren't parsed into steps
+BUILDKIT_TRACE_ID = "moby.buildkit.trace"
+
+# Label used to store the build fingerprint on the images built by xnat4tests
+FINGERPRINT_LABEL = "org.xnat4tests.fingerprint"
+# Label used to mark the snapshots of initialised containers (which inherit the
+# fingerprint label of the image they were launched from)
+WARM_SNAPSHOT_LABEL = "org.xnat4tests.warm-snapshot"
+
+
+def build_fingerprint(config: Config) -> str:
+    """Calculates a fingerprint of the inputs to the Docker build, i.e. the contents
+    of the "docker-src" directory and the build arguments, so that images only need
+    to be rebuilt when one of them changes
+
+    Parameters
+    ----------
+    config : Config
+        the configuration containing the build arguments
+
+    Returns
+    -------
+    str
+        hex digest of the build inputs
+    """
+    hsh = hashlib.sha256()
+    for fpath in sorted(p for p in SRC_DIR.rglob("*") if p.is_file()):
+        hsh.update(fpath.relative_to(SRC_DIR).as_posix().encode())
+        hsh.update(fpath.read_bytes())
+    hsh.update(json.dumps(attrs.asdict(config.build_args), sort_keys=True).encode())
+    return hsh.hexdigest()
+
+
+def build_image(config: Config, dc: docker.DockerClient):
+    """Builds the XNAT image specified by the configuration unless an image with a
+    matching build fingerprint already exists, in which case it is tagged with the
+    configured image name and reused
+
+    Parameters
+    ----------
+    config : Config
+        the configuration specifying the image to build
+    dc : docker.DockerClient
+        the Docker client to build the image with
+
+    Returns
+    -------
+    docker.models.images.Image
+        the built (or reused) image
+    """
+    fingerprint = build_fingerprint(config)
+
+    cached = [
+        i
+        for i in dc.images.list(filters={"label": f"{FINGERPRINT_LABEL}={fingerprint}"})
+        if WARM_SNAPSHOT_LABEL not in i.labels
+    ]
+    if cached:
+        image = cached[0]
+        tag = config.docker_image
+        if ":" not in tag.split("/")[-1]:
+            tag += ":latest"
+        if tag not in image.tags:
+            image.tag(tag)
+            image.reload()
+        logger.info(
+            "Found existing %s image matching build fingerprint %s, skipping build",
+            config.docker_image,
+            fingerprint[:12],
+        )
+        return image
+
+    logger.info("Building %s", config.docker_image)
+    files = {f"artifacts/{n}": p for n, p in fetch_artifacts(config).items()}
+    with PipeStream(lambda f: write_build_context(f, files)) as context:
+        image = _stream_build(
+            config,
+            dc,
+            fingerprint,
+            fileobj=context,
+            custom_context=True,
+        )
+    logger.info("Built %s successfully", config.docker_image)
+    return image
+
+
+def write_build_context(
+    fileobj: ty.BinaryIO, files: ty.Dict[str, ty.Union[Path, bytes]] = None
+):
+    """Writes a tar stream of the Docker build context, i.e. the contents of the
+    "docker-src" directory plus any additional files, to a file-like object
+
+    Parameters
+    ----------
+    fileobj : BinaryIO
+        the file-like object to write the tar stream to
+    files : dict[str, Path or bytes], optional
+        additional files to add to (or override in) the build context, mapped from
+        their path within the context to either a path to a file to add or the
+        contents of the file
+    """
+    if files is None:
+        files = {}
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        for fpath in sorted(p for p in SRC_DIR.rglob("*") if p.is_file()):
+            arcname = fpath.relative_to(SRC_DIR).as_posix()
+            if arcname not in files:
+                tar.add(str(fpath), arcname=arcname)
+        for arcname, contents in files.items():
+            if isinstance(contents, bytes):
+                tarinfo = tarfile.TarInfo(arcname)
+                tarinfo.size = len(contents)
+                tarinfo.mtime = int(time.time())
+                tar.addfile(tarinfo, io.BytesIO(contents))
+            else:
+                tar.add(str(contents), arcname=arcname)
+
+
+def warm_image_tag(config: Config, image) -> str:
+    """Returns the tag of the "warm" snapshot of containers launched from the image
+    with the given configuration, which is keyed on the build fingerprint of the
+    image and the configuration options that affect the state of the initialised
+    container
+
+    Parameters
+    ----------
+    config : Config
+        the configuration the container is launched with
+    image : docker.models.images.Image
+        the image the container is launched from
+
+    Returns
+    -------
+    str
+        the tag of the warm snapshot
+    """
+    hsh = hashlib.sha256()
+    hsh.update((image.labels.get(FINGERPRINT_LABEL) or image.id).encode())
+    hsh.update(
+        json.dumps(
+            {
+                "xnat_root_dir": str(config.xnat_root_dir),
+                "xnat_mnt_dirs": config.xnat_mnt_dirs,
+                # Directories that aren't bind-mounted are missing from the snapshot
+                "xnat_mnt_modes": config.xnat_mnt_modes,
+                # Whether the reset template is included in the snapshot
+                "reset_template": config.reset_template,
+            },
+            sort_keys=True,
+        ).encode()
+    )
+    return "warm-" + hsh.hexdigest()[:16]
+
+
+def _build_args(config: Config) -> ty.Dict[str, str]:
+    """Converts the build args in the configuration into the form passed to Docker"""
+    build_args = {}
+    for name, value in attrs.asdict(config.build_args).items():
+        if isinstance(value, bool):
+            value = str(value).lower()
+        build_args[name.upper()] = str(value)
+    return build_args
+
+
+def _stream_build(config: Config, dc: docker.DockerClient, fingerprint: str, **kwargs):
+    """Builds the image using the streaming low-level API, logging each step of the
+    Dockerfile as it runs and appending a report of the time taken by each step, and
+    whether it was cached, to "builds.jsonl" in the reports directory, whether the
+    build succeeds or not.
+
+    The steps are parsed from the output of the classic builder, which is what the
+    Docker Engine API's build endpoint (and so docker-py) uses. If the daemon builds
+    with BuildKit instead, its output can't be parsed into steps, so only the total
+    time is reported
+
+    Parameters
+    ----------
+    config : Config
+        the configuration specifying the image to build
+    dc : docker.DockerClient
+        the Docker client to build the image with
+    fingerprint : str
+        the build fingerprint to label the image with
+    **kwargs
+        the build context to pass to the low-level build API
+
+    Returns
+    -------
+    docker.models.images.Image
+        the built image
+    """
+    started = datetime.now()
+    build_start = step_start = time.monotonic()
+    build_log = []
+    steps = []
+    image_id = None
+    builder = "classic"
+    status = "failed"
+
+    def end_step():
+        if steps:
+            steps[-1]["seconds"] = round(time.monotonic() - step_start, 3)
+
+    try:
+        for chunk in dc.api.build(
+            tag=config.docker_image,
+            buildargs=_build_args(config),
+            labels={FINGERPRINT_LABEL: fingerprint},
+            rm=True,
+            decode=True,
+            **kwargs,
+        ):
+            if "error" in chunk:
+                build_log.append(chunk["error"])
+                raise RuntimeError(
+                    f"Building '{config.docker_image}' failed with the following "
+                    "errors:\n\n" + "".join(build_log)
+                )
+            if chunk.get("id") == BUILDKIT_TRACE_ID:
+                builder = "buildkit"
+                continue
+            if "aux" in chunk:
+                image_id = chunk["aux"].get("ID", image_id)
+                continue
+            line = chunk.get("stream", "")
+            build_log.append(line)
+            match = BUILD_STEP_RE.match(line)
+            if match:
+                end_step()
+                step_start = time.monotonic()
+                steps.append(
+                    {
+                        "step": int(match.group(1)),
+                        "instruction": match.group(2).strip(),
+                        "cached": False,
+                    }
+                )
+                logger.info("%s", line.strip())
+            elif line.strip() == "---> Using cache" and steps:
+                steps[-1]["cached"] = True
+            elif line.strip():
+                match = BUILD_SUCCESS_RE.match(line)
+                if match and image_id is None:
+                    image_id = match.group(1)
+                logger.debug("%s", line.rstrip())
+        end_step()
+        status = "succeeded"
+    finally:
+        _write_build_report(
+            config,
+            {
+                "image": config.docker_image,
+                "image_id": image_id,
+                "fingerprint": fingerprint,
+                "started": started.isoformat(),
+                "seconds": round(time.monotonic() - build_start, 3),
+                "status": status,
+                "builder": builder,
+                "steps": steps,
+            },
+        )
+
+    if builder == "buildkit":
+        logger.info(
+            "%s was built with BuildKit, so the time taken by each step wasn't "
+            "recorded",
+            config.docker_image,
+        )
+    for step in sorted(steps, key=lambda s: s.get("seconds", 0), reverse=True)[:3]:
+        logger.info(
+            "Build step %d took %.1fs%s: %s",
+            step["step"],
+            step.get("seconds", 0),
+            " (cached)" if step["cached"] else "",
+            step["instruction"],
+        )
+
+    return dc.images.get(image_id if image_id else config.docker_image)
+
+
+def _write_build_report(config: Config, report: ty.Dict[str, ty.Any]):
+    """Appends a report of an image build to "builds.jsonl" in the reports directory"""
+    config.reports_dir.mkdir(parents=True, exist_ok=True)
+    with open(config.reports_dir / "builds.jsonl", "a") as f:
+        f.write(json.dumps(report) + "\n")
@@ -1,7 +1,10 @@
 import click
-from .base import start_xnat, stop_xnat, restart_xnat
+from .base import start_xnat, stop_xnat, restart_xnat, reset_xnat
 from .data import add_data, AVAILABLE_DATASETS
 from .registry import start_registry, stop_registry
+from .snapshots import snapshot_xnat, restore_snapshot, list_snapshots, COPY_METHODS
+from .config import Config
+from .timing import load_history, summarise
 from .utils import set_loggers
 from ._version import get_versions
 
@@ -66,7 +69,8 @@ def cli(ctx, config):
     default=True,
     help=(
         "Rebuild the Docker image to pick up any configuration changes since it was "
-        "built"
+        "built. The build is skipped if an image with a matching build fingerprint "
+        "(Docker sources + build args) already exists"
     ),
 )
 @click.option(
@@ -78,6 +82,16 @@ def cli(ctx, config):
         "container if present"
     ),
 )
+@click.option(
+    "--warm-snapshot/--no-warm-snapshot",
+    type=bool,
+    default=False,
+    help=(
+        "Launch the container from a snapshot of a previously initialised container "
+        "if present, or save a snapshot of the container after it has been "
+        "initialised for later launches"
+    ),
+)
 @click.option(
     "--loglevel",
     "-l",
@@ -94,17 +108,38 @@ def cli(ctx, config):
         "faster but requires XNAT 1.8.2 or later"
     ),
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=1,
+    help="The number of sessions to upload concurrently when adding sample data",
+)
 @click.pass_context
-def start_cli(ctx, loglevel, keep_mounts, rebuild, relaunch, with_data, upload_method):
+def start_cli(
+    ctx,
+    loglevel,
+    keep_mounts,
+    rebuild,
+    relaunch,
+    warm_snapshot,
+    with_data,
+    upload_method,
+    jobs,
+):
 
     set_loggers(loglevel)
 
     start_xnat(
-        config_name=ctx.obj, keep_mounts=keep_mounts, rebuild=rebuild, relaunch=relaunch
+        config_name=ctx.obj,
+        keep_mounts=keep_mounts,
+        rebuild=rebuild,
+        relaunch=relaunch,
+        warm_snapshot=warm_snapshot,
     )
 
     for dataset in with_data:
-        add_data(dataset, config_name=ctx.obj, upload_method=upload_method)
+        add_data(dataset, config_name=ctx.obj, upload_method=upload_method, jobs=jobs)
 
 
 @cli.command(
@@ -117,13 +152,18 @@ def start_cli(ctx, loglevel, keep_mounts, rebuild, relaunch, with_data, upload_m
     default="info",
     help="Set the level of logging detail",
 )
+@click.option(
+    "--wait/--no-wait",
+    default=False,
+    help="Wait until the containers have been removed before returning",
+)
 @click.pass_context
-def stop_cli(ctx, loglevel):
+def stop_cli(ctx, loglevel, wait):
 
     set_loggers(loglevel)
 
-    stop_registry(config_name=ctx.obj)
-    stop_xnat(config_name=ctx.obj)
+    stop_registry(config_name=ctx.obj, wait=wait)
+    stop_xnat(config_name=ctx.obj, wait=wait)
 
 
 @cli.command(
@@ -146,6 +186,27 @@ def restart_cli(ctx, loglevel):
     restart_xnat(config_name=ctx.obj)
 
 
+@cli.command(
+    name="reset",
+    help="""Resets the test XNAT instance to the state it was launched in, without
+relaunching its container. Requires "reset_template: true" to have been set in the
+configuration when it was launched""",
+)
+@click.option(
+    "--loglevel",
+    "-l",
+    type=LOGLEVEL_CHOICE,
+    default="info",
+    help="Set the level of logging detail",
+)
+@click.pass_context
+def reset_cli(ctx, loglevel):
+
+    set_loggers(loglevel)
+
+    reset_xnat(config_name=ctx.obj)
+
+
 @cli.command(
     name="add-data",
     help=f"""Adds sample data to the XNAT instance
@@ -169,11 +230,110 @@ DATASET is the name of the dataset to add (out of {AVAILABLE_DATASETS})""",
         "faster but requires XNAT 1.8.2 or later"
     ),
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=1,
+    help="The number of sessions to upload concurrently when adding sample data",
+)
 @click.pass_context
-def add_data_cli(ctx, loglevel, dataset, upload_method):
+def add_data_cli(ctx, loglevel, dataset, upload_method, jobs):
 
     set_loggers(loglevel)
-    add_data(dataset, config_name=ctx.obj, upload_method=upload_method)
+    add_data(dataset, config_name=ctx.obj, upload_method=upload_method, jobs=jobs)
+
+
+@cli.command(
+    name="snapshot",
+    help="""Saves a named snapshot of the database and mounted directories of the test
+XNAT instance
+
+NAME is the name of the snapshot""",
+)
+@click.argument("name")
+@click.option(
+    "--loglevel",
+    "-l",
+    type=LOGLEVEL_CHOICE,
+    default="info",
+    help="Set the level of logging detail",
+)
+@click.option(
+    "--method",
+    type=click.Choice(COPY_METHODS),
+    default="auto",
+    help="How to copy the mounted directories",
+)
+@click.pass_context
+def snapshot_cli(ctx, name, loglevel, method):
+
+    set_loggers(loglevel)
+    snapshot_xnat(name, config_name=ctx.obj, method=method)
+
+
+@cli.command(
+    name="restore",
+    help="""Restores the test XNAT instance to a named snapshot
+
+NAME is the name of the snapshot""",
+)
+@click.argument("name")
+@click.option(
+    "--loglevel",
+    "-l",
+    type=LOGLEVEL_CHOICE,
+    default="info",
+    help="Set the level of logging detail",
+)
+@click.option(
+    "--method",
+    type=click.Choice(COPY_METHODS),
+    default="auto",
+    help="How to copy the mounted directories back",
+)
+@click.pass_context
+def restore_cli(ctx, name, loglevel, method):
+
+    set_loggers(loglevel)
+    restore_snapshot(name, config_name=ctx.obj, method=method)
+
+
+@cli.command(
+    name="snapshots",
+    help="""Lists the names of the saved snapshots of the test XNAT instance""",
+)
+@click.pass_context
+def snapshots_cli(ctx):
+
+    for name in list_snapshots(config_name=ctx.obj):
+        click.echo(name)
+
+
+@cli.command(
+    name="timings",
+    help="""Prints percentiles of the time taken by each phase of starting the test
+XNAT instance over its recorded startup history""",
+)
+@click.option(
+    "--last",
+    "-n",
+    type=int,
+    default=None,
+    help="Only include the given number of most recent startups",
+)
+@click.pass_context
+def timings_cli(ctx, last):
+
+    summary = summarise(load_history(Config.load(ctx.obj), last=last))
+    if not summary:
+        raise click.ClickException("No startups have been recorded yet")
+    click.echo(f"{'phase':<28}{'n':>5}{'p50 (s)':>10}{'p90 (s)':>10}{'p99 (s)':>10}")
+    for phase, stats in summary.items():
+        click.echo(
+            f"{phase:<28}{stats['n']:>5}{stats['p50']:>10.1f}{stats['p90']:>10.1f}"
+            f"{stats['p99']:>10.1f}"
+        )
 
 
 @cli.group(
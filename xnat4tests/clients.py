@@ -0,0 +1,211 @@
+"""Process-wide registries of the clients used to talk to the Docker daemon and to
+XNAT, so that each Docker connection pool (and API version negotiation) is only set up
+once per Docker host/context, and XNAT logins (and schema discovery) are only
+performed once per instance, rather than on every call
+"""
+import os
+import atexit
+import threading
+import typing as ty
+from contextlib import contextmanager
+import docker
+import xnat
+from xnat.session import XNATSession
+from docker.constants import DEFAULT_MAX_POOL_SIZE
+from docker.context import ContextAPI
+from docker.context.config import get_current_context_name
+from .utils import logger
+from .config import Config
+
+
+# Environment variables that determine which daemon docker.from_env connects to
+DOCKER_ENV_VARS = ["DOCKER_HOST", "DOCKER_TLS_VERIFY", "DOCKER_CERT_PATH"]
+
+_docker_clients: ty.Dict[tuple, docker.DockerClient] = {}
+_docker_clients_lock = threading.Lock()
+
+# Idle authenticated XNAT sessions, keyed by server, user and whether the session
+# has parsed the data model
+_xnat_sessions: ty.Dict[tuple, ty.List[XNATSession]] = {}
+_xnat_sessions_lock = threading.Lock()
+# Timeout of the request that checks idle sessions are still valid on checkout
+SESSION_CHECK_TIMEOUT = 5
+
+
+def docker_client(config: ty.Union[str, Config, None] = None) -> docker.DockerClient:
+    """Returns the shared client for the Docker daemon selected by the environment
+    (i.e. DOCKER_HOST or the current Docker context), creating it on first use
+
+    Parameters
+    ----------
+    config : str or Config, optional
+        the configuration (or name of the configuration file) that sets the size of
+        the client's connection pool, "docker_pool_size", if it is created
+
+    Returns
+    -------
+    docker.DockerClient
+        the shared client
+    """
+    if config is not None:
+        pool_size = Config.load(config).docker_pool_size
+    else:
+        pool_size = DEFAULT_MAX_POOL_SIZE
+    key = _client_key()
+    with _docker_clients_lock:
+        try:
+            return _docker_clients[key]
+        except KeyError:
+            pass
+        host, context = key[:2]
+        if host or context == "default":
+            client = docker.from_env(max_pool_size=pool_size)
+        else:
+            # docker.from_env doesn't read Docker contexts so connect to the current
+            # context's endpoint directly
+            ctx = ContextAPI.get_context(context)
+            client = docker.DockerClient(
+                base_url=ctx.Host, tls=ctx.TLSConfig, max_pool_size=pool_size
+            )
+        logger.debug("Created Docker client for %s", host or f"'{context}' context")
+        _docker_clients[key] = client
+        return client
+
+
+def set_docker_client(client: ty.Optional[docker.DockerClient]):
+    """Sets the client that is returned for the Docker daemon selected by the current
+    environment, e.g. to inject a stand-in in tests. Passing None removes it so a
+    new client is created on next use
+
+    Parameters
+    ----------
+    client : docker.DockerClient or None
+        the client to use
+    """
+    key = _client_key()
+    with _docker_clients_lock:
+        if client is None:
+            _docker_clients.pop(key, None)
+        else:
+            _docker_clients[key] = client
+
+
+@atexit.register
+def close_docker_clients():
+    """Closes the connection pools of all shared Docker clients"""
+    with _docker_clients_lock:
+        clients = list(_docker_clients.values())
+        _docker_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:  # the daemon may have already gone away
+            pass
+
+
+def _client_key() -> tuple:
+    """The Docker host and context selected by the environment, along with the other
+    variables that affect the connection"""
+    host = os.environ.get("DOCKER_HOST")
+    context = None
+    if not host:
+        context = os.environ.get("DOCKER_CONTEXT") or get_current_context_name()
+    return (host, context) + tuple(os.environ.get(v) for v in DOCKER_ENV_VARS[1:])
+
+
+@contextmanager
+def lease_session(
+    config: ty.Union[str, Config] = "default", parse_model: bool = True
+) -> ty.Iterator[XNATSession]:
+    """Leases an authenticated session with the test XNAT instance from the pool of
+    idle sessions, creating a new one if there are none (or none that are still
+    valid), and returns it to the pool afterwards. Unlike sessions returned by
+    connect, leased sessions must not be disconnected by the caller
+
+    Parameters
+    ----------
+    config : str or Config
+        the configuration (or name of the configuration file) of the instance
+    parse_model : bool
+        whether the session needs the XNAT data model to be parsed (i.e. to use
+        "session.classes"), which can be skipped when only making raw REST calls
+
+    Yields
+    ------
+    xnat.session.XNATSession
+        the leased session
+    """
+    config = Config.load(config)
+    key = (config.xnat_uri, config.xnat_user, parse_model)
+    session = None
+    while session is None:
+        with _xnat_sessions_lock:
+            idle = _xnat_sessions.get(key)
+            candidate = idle.pop() if idle else None
+        if candidate is None:
+            session = new_session(config, parse_model=parse_model)
+        elif _session_valid(candidate):
+            # Objects cached by previous lessees may be stale
+            candidate.clearcache()
+            session = candidate
+        else:
+            logger.debug("Discarding invalid session with %s", config.xnat_uri)
+            _disconnect(candidate)
+    try:
+        yield session
+    finally:
+        with _xnat_sessions_lock:
+            _xnat_sessions.setdefault(key, []).append(session)
+
+
+def new_session(config: Config, parse_model: bool = True) -> XNATSession:
+    """Logs into the test XNAT instance, returning a new session"""
+    logger.info("Connecting to %s as '%s'", config.xnat_uri, config.xnat_user)
+    return xnat.connect(
+        config.xnat_uri,
+        user=config.xnat_user,
+        password=config.xnat_password,
+        no_parse_model=not parse_model,
+    )
+
+
+def release_sessions(config: ty.Union[str, Config] = "default"):
+    """Disconnects the idle sessions with the test XNAT instance, e.g. when it is
+    stopped or relaunched
+
+    Parameters
+    ----------
+    config : str or Config
+        the configuration (or name of the configuration file) of the instance
+    """
+    config = Config.load(config)
+    with _xnat_sessions_lock:
+        keys = [k for k in _xnat_sessions if k[0] == config.xnat_uri]
+        sessions = [s for k in keys for s in _xnat_sessions.pop(k)]
+    for session in sessions:
+        _disconnect(session)
+
+
+@atexit.register
+def close_xnat_sessions():
+    """Disconnects all idle XNAT sessions"""
+    with _xnat_sessions_lock:
+        sessions = [s for ss in _xnat_sessions.values() for s in ss]
+        _xnat_sessions.clear()
+    for session in sessions:
+        _disconnect(session)
+
+
+def _session_valid(session: XNATSession) -> bool:
+    try:
+        session.get("/data/JSESSION", timeout=SESSION_CHECK_TIMEOUT)
+    except Exception:
+        return False
+    return True
+
+
+def _disconnect(session: XNATSession):
+    try:
+        session.disconnect()
+    except Exception:  # the instance may have already been stopped
+        pass
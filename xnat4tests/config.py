@@ -1,13 +1,50 @@
+import re
+import copy
 import yaml
 import warnings
+import threading
 from pathlib import Path
 import typing as ty
 import attrs
 from .utils import XNAT4TESTS_HOME
 
 
+# Use the LibYAML-based loader if PyYAML was built with it as it is much faster
+_SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Tag prefix of paths dumped by older versions, e.g. pathlib.PosixPath
+PATH_TAG_PREFIX = "tag:yaml.org,2002:python/object/apply:pathlib."
+
+
+class ConfigLoader(_SafeLoader):
+    """Safe YAML loader that can also load the Python-specific tags of paths dumped
+    into configuration files by older versions"""
+
+
+def _construct_path(loader, tag_suffix, node):
+    if not tag_suffix.endswith("Path"):
+        raise yaml.constructor.ConstructorError(
+            None, None, f"Unsupported tag {PATH_TAG_PREFIX}{tag_suffix}", node.start_mark
+        )
+    return Path(*loader.construct_sequence(node))
+
+
+ConfigLoader.add_multi_constructor(PATH_TAG_PREFIX, _construct_path)
+
 DEFAULT_XNAT_ROOT = XNAT4TESTS_HOME / "xnat_root" / "default"
 DEFAULT_BUILD_DIR = XNAT4TESTS_HOME / "build"
+DEFAULT_ARTIFACTS_DIR = XNAT4TESTS_HOME / "artifacts"
+DEFAULT_REPORTS_DIR = XNAT4TESTS_HOME / "reports"
+DEFAULT_SNAPSHOTS_DIR = XNAT4TESTS_HOME / "snapshots"
+MNT_MODE_RE = re.compile(r"bind|volume|tmpfs(:\w+)?")
+# Directories that the container service mounts into the containers it launches
+# (via its path translation to the XNAT root directory on the host)
+CONTAINER_SERVICE_DIRS = ["archive", "build"]
+
+
+# Configurations loaded from each file, along with the modification time and size of
+# the file when they were loaded
+_config_cache: ty.Dict[Path, ty.Tuple[ty.Tuple[int, int], "Config"]] = {}
+_config_cache_lock = threading.Lock()
 
 
 @attrs.define
@@ -17,6 +54,23 @@ class BuildArgs:
     xnat_batch_launch_plugin_version: str = "0.9.0-xpl"
     java_ms: str = "256m"
     java_mx: str = "2g"
+    # Boot XNAT once at build time so the database schema is created in the image
+    warm_schema: bool = False
+    # Create a JVM class-data-sharing archive from a training boot at build time
+    jvm_cds: bool = False
+    # Tomcat startup profile, either "default" or "fast" (skips most JAR scanning)
+    tomcat_profile: str = attrs.field(
+        default="default", validator=attrs.validators.in_(["default", "fast"])
+    )
+    # Postgres durability profile, either "default" or "throughput" (turns off fsync,
+    # synchronous commits and full-page writes, so data may be lost if it crashes)
+    postgres_profile: str = attrs.field(
+        default="default", validator=attrs.validators.in_(["default", "throughput"])
+    )
+    postgres_shared_buffers: str = "128MB"
+    postgres_work_mem: str = "4MB"
+    # Where the Postgres data directory is placed within the image
+    postgres_data_dir: str = "/var/lib/postgresql/data"
 
 
 @attrs.define
@@ -29,7 +83,20 @@ class Config:
         "archive",
         "prearchive",
     ]
+    # How each of the "xnat_mnt_dirs" is mounted into the container, either "bind"
+    # (from "xnat_root_dir", the default), "volume" (a named Docker volume) or "tmpfs"
+    # (in memory, optionally capped at a size, e.g. "tmpfs:2g")
+    xnat_mnt_modes: ty.Dict[str, str] = attrs.field(factory=dict)
+    # Deprecated: no longer used as the build context is streamed straight to Docker,
+    # but kept so that existing configuration files still load
     docker_build_dir: Path = attrs.field(default=DEFAULT_BUILD_DIR, converter=Path)
+    # Local store of the downloaded XNAT web-app and plugin versions
+    artifacts_dir: Path = attrs.field(default=DEFAULT_ARTIFACTS_DIR, converter=Path)
+    # Where machine-readable reports of image builds are written
+    reports_dir: Path = attrs.field(default=DEFAULT_REPORTS_DIR, converter=Path)
+    # Where snapshots of the database and mounted directories are saved. Should be on
+    # the same filesystem as "xnat_root_dir" for reflinks and hardlinks to be used
+    snapshots_dir: Path = attrs.field(default=DEFAULT_SNAPSHOTS_DIR, converter=Path)
     docker_image: str = "xnat4tests"
     docker_container: str = "xnat4tests"
     docker_host: str = "localhost"
@@ -39,12 +106,27 @@ class Config:
     docker_registry_image: str = "registry"
     docker_registry_container: str = "xnat4tests-docker-registry"
     docker_network_name: str = "xnat4tests"
+    # Maximum number of connections to the Docker daemon kept open by the client
+    docker_pool_size: int = 10
     # Must be 80 to use as XNAT registry avoid bug in XNAT CS config
     registry_port: str = attrs.field(default="80")
     # xnat_user: str = "admin"
     # xnat_password: str = "admin"
     connection_attempts: int = 20
+    # Maximum delay between readiness probes, which back off exponentially up to it
     connection_attempt_sleep: int = 5
+    # Seconds to wait for XNAT to become ready, defaults to
+    # connection_attempts * connection_attempt_sleep
+    readiness_timeout: ty.Optional[float] = None
+    # How to detect that XNAT is ready, either by waiting for the container's health
+    # check to pass ("health"), polling a lightweight endpoint ("probe") or following
+    # the startup in the container logs ("logs")
+    readiness_check: str = attrs.field(
+        default="health", validator=attrs.validators.in_(["health", "probe", "logs"])
+    )
+    # Take a template of the initialised database when the instance is launched, so
+    # that it can be reset with reset_xnat (adds a database dump to the startup)
+    reset_template: bool = False
     build_args: BuildArgs = attrs.field(
         factory=dict, converter=lambda d: BuildArgs(**d)
     )
@@ -72,15 +154,34 @@ class Config:
                 "feature"
             )
 
+    @xnat_mnt_modes.validator
+    def xnat_mnt_modes_validator(self, _, xnat_mnt_modes):
+        for dname, mode in xnat_mnt_modes.items():
+            if dname not in self.xnat_mnt_dirs:
+                raise ValueError(
+                    f"Mount mode given for '{dname}', which is not one of the mounted "
+                    f"directories {self.xnat_mnt_dirs}"
+                )
+            if not MNT_MODE_RE.fullmatch(mode):
+                raise ValueError(
+                    f"Unrecognised mount mode '{mode}' for '{dname}', can be 'bind', "
+                    "'volume', 'tmpfs' or 'tmpfs:<size>'"
+                )
+        not_bound = [d for d in CONTAINER_SERVICE_DIRS if self.mnt_mode(d) != "bind"]
+        if not_bound:
+            warnings.warn(
+                f"{not_bound} directories are not bind-mounted from the XNAT root "
+                "directory, so the container service won't be able to mount them into "
+                "the containers it launches"
+            )
+
     @docker_build_dir.validator
     def docker_build_dir_validator(self, _, docker_build_dir):
-        if (
-            docker_build_dir != DEFAULT_BUILD_DIR
-            and not docker_build_dir.parent.exists()
-        ):
-            raise Exception(
-                f"Parent of build directory {str(docker_build_dir.parent)} "
-                "does not exist"
+        if docker_build_dir != DEFAULT_BUILD_DIR:
+            warnings.warn(
+                "'docker_build_dir' is deprecated and ignored, as the build context is "
+                "now streamed straight to Docker",
+                DeprecationWarning,
             )
 
     @xnat_root_dir.validator
@@ -93,7 +194,9 @@ class Config:
 
     @classmethod
     def load(cls, name):
-        """Loads a configuration object from a YAML file
+        """Loads a configuration object from a YAML file. Loaded configurations are
+        cached until the file is modified, and a copy of the cached configuration is
+        returned each time
 
         Parameters
         ----------
@@ -127,12 +230,11 @@ class Config:
         else:  # Treat as the filename base of a YAML file in the within xnat4tests HOME
             config_file_path = XNAT4TESTS_HOME / "configs" / f"{name}.yaml"
 
-            # Create parent dir if it doesn't already exist
-            config_file_path.parent.mkdir(exist_ok=True, parents=True)
-
         # Load custom config saved in "config.json" and override defaults
         if not config_file_path.exists():
             if name == "default":
+                # Create parent dir if it doesn't already exist
+                config_file_path.parent.mkdir(exist_ok=True, parents=True)
                 # Write a default configuration file with all options commented out for ease
                 # of customisation
                 yaml_lines = yaml.dump(attrs.asdict(Config())).split("\n")
@@ -144,13 +246,31 @@ class Config:
                     f"Could not find configuration file at {config_file_path}"
                 )
 
+        # Return the previously loaded configuration if the file hasn't changed since
+        cache_key = config_file_path.resolve()
+        file_stat = config_file_path.stat()
+        signature = (file_stat.st_mtime_ns, file_stat.st_size)
+        with _config_cache_lock:
+            cached = _config_cache.get(cache_key)
+        if cached is not None and cached[0] == signature:
+            # Copy it so that changes made by callers don't leak into later loads
+            return copy.deepcopy(cached[1])
+
         with open(config_file_path) as f:
-            dct = yaml.load(f, Loader=yaml.Loader)
+            dct = yaml.load(f, Loader=ConfigLoader)
 
         if dct is None:
             dct = {}
 
-        return cls(loaded_from=config_file_path, **dct)
+        config = cls(loaded_from=config_file_path, **dct)
+        with _config_cache_lock:
+            _config_cache[cache_key] = (signature, config)
+        return copy.deepcopy(config)
+
+    def mnt_mode(self, dname: str) -> str:
+        """Returns how the directory is mounted into the container, "bind", "volume"
+        or "tmpfs" (without the size cap)"""
+        return self.xnat_mnt_modes.get(dname, "bind").split(":")[0]
 
     @property
     def xnat_uri(self):
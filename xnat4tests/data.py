@@ -1,41 +1,28 @@
-import os
+import threading
+import functools
 import typing as ty
 import tempfile
-import shutil
 import zipfile
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from xnat.exceptions import XNATResponseError
-from .base import connect
+from .clients import lease_session
 from .config import Config
-from .utils import logger
+from .utils import logger, PipeStream
 
 
 AVAILABLE_DATASETS = ["dummydicom", "user-training", "openneuro-t1w", "simple-dir"]
 
-
-@contextmanager
-def set_cwd(path):
-    """Sets the current working directory to `path` and back to original
-    working directory on exit
-
-    Parameters
-    ----------
-    path : str
-        The file system path to set as the current working directory
-    """
-    pwd = Path.cwd()
-    os.chdir(path)
-    try:
-        yield path
-    finally:
-        os.chdir(pwd)
+# Locks that coordinate the creation of projects between concurrent uploads
+_project_locks: ty.Dict[ty.Tuple[str, str], threading.Lock] = {}
+_project_locks_lock = threading.Lock()
 
 
 def add_data(
     dataset: str,
     config_name: ty.Union[str, dict] = "default",
     upload_method: str = "direct-archive",
+    jobs: int = 1,
 ):
     """Uploads sample test data into the XNAT repository for use in test regimes
 
@@ -45,11 +32,21 @@ def add_data(
         name of the dataset to add. Can be one of: ["dummydicom"]
     config_name : str or dict, optional
         the configuration that specifies how to connect to the XNAT instance
+    upload_method : str
+        how DICOM sessions are uploaded, "direct-archive", "prearchive" or "direct"
+    jobs : int
+        the number of sessions to upload concurrently
+
+    Raises
+    ------
+    RuntimeError
+        if any of the sessions fail to upload, after the others have been uploaded
     """
     config = Config.load(config_name)
 
     try:
-        connect(config)
+        with lease_session(config):
+            pass
     except Exception:
         raise RuntimeError(
             f"XNAT instance not running at {config.xnat_uri}. "
@@ -57,6 +54,9 @@ def add_data(
             f"to launch it"
         )
 
+    direct_archive = upload_method == "direct-archive"
+    uploads = []
+
     if dataset == "dummydicom":
         from medimages4tests.dummy.dicom.mri.t1w.siemens.skyra.syngo_d13c import (
             get_image as t1w_syngo,
@@ -68,46 +68,46 @@ def add_data(
             get_image as fmap_syngo,
         )
 
-        if upload_method == "direct": 
-            _upload_directly(
-                {
-                    "t1w": t1w_syngo(), "dwi": dwi_syngo(), "fmap": fmap_syngo()
-                },
-                config,
-                project_id="dummydicomproject",
-                subject_id="dummydicomsubject",
-                session_id="dummydicomsession",
-                resource_name="DICOM",
+        if upload_method == "direct":
+            uploads.append(
+                functools.partial(
+                    _upload_directly,
+                    {"t1w": t1w_syngo(), "dwi": dwi_syngo(), "fmap": fmap_syngo()},
+                    config,
+                    project_id="dummydicomproject",
+                    subject_id="dummydicomsubject",
+                    session_id="dummydicomsession",
+                    resource_name="DICOM",
+                )
             )
         else:
-            _upload_dicom_data(
-                [t1w_syngo(), dwi_syngo(), fmap_syngo()],
-                config,
-                project_id="dummydicomproject",
-                subject_id="dummydicomsubject",
-                session_id="dummydicomsession",
-                direct_archive=(upload_method == "direct-archive"),
+            uploads.append(
+                functools.partial(
+                    _upload_dicom_data,
+                    [t1w_syngo(), dwi_syngo(), fmap_syngo()],
+                    config,
+                    project_id="dummydicomproject",
+                    subject_id="dummydicomsubject",
+                    session_id="dummydicomsession",
+                    direct_archive=direct_archive,
+                )
             )
 
     elif dataset == "openneuro-t1w":
         from medimages4tests.mri.neuro.t1w import get_image as openneuro_t1w
 
-        _upload_directly(
-            {"t1w": openneuro_t1w()},
-            config,
-            project_id="OPENNEURO_T1W",
-            subject_id="subject01",
-            session_id="subject01_MR01",
-            resource_name="NIFTI",
-        )
-        _upload_directly(
-            {"t1w": openneuro_t1w()},
-            config,
-            project_id="OPENNEURO_T1W",
-            subject_id="subject02",
-            session_id="subject02_MR01",
-            resource_name="NIFTI",
-        )
+        for subject_id in ("subject01", "subject02"):
+            uploads.append(
+                functools.partial(
+                    _upload_directly,
+                    {"t1w": openneuro_t1w()},
+                    config,
+                    project_id="OPENNEURO_T1W",
+                    subject_id=subject_id,
+                    session_id=f"{subject_id}_MR01",
+                    resource_name="NIFTI",
+                )
+            )
 
     elif dataset == "simple-dir":
 
@@ -118,124 +118,87 @@ def add_data(
             a_file = a_dir / f"file{i + 1}.txt"
             a_file.write_text(f"A dummy file - {i + 1}\n")
 
-        _upload_directly(
-            {"a-directory": a_dir},
-            config,
-            project_id="SIMPLE_DIR",
-            subject_id="subject01",
-            session_id="subject01_1",
-            resource_name="DIRECTORY",
-        )
-        _upload_directly(
-            {"a-directory": a_dir},
-            config,
-            project_id="SIMPLE_DIR",
-            subject_id="subject02",
-            session_id="subject02_1",
-            resource_name="DIRECTORY",
-        )
+        for subject_id in ("subject01", "subject02"):
+            uploads.append(
+                functools.partial(
+                    _upload_directly,
+                    {"a-directory": a_dir},
+                    config,
+                    project_id="SIMPLE_DIR",
+                    subject_id=subject_id,
+                    session_id=f"{subject_id}_1",
+                    resource_name="DIRECTORY",
+                )
+            )
 
     elif dataset == "user-training":
+        from medimages4tests.dummy.dicom.mri.t1w.siemens.skyra.syngo_d13c import (
+            get_image as t1w_syngo,
+        )
         from medimages4tests.dummy.dicom.mri.fmap.siemens.skyra.syngo_d13c import (
             get_image as fmap_syngo,
         )
 
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="CONT01",
-            session_id="CONT01_MR01",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="CONT02",
-            session_id="CONT02_MR01",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="CONT01",
-            session_id="CONT01_MR02",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="CONT02",
-            session_id="CONT02_MR02",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="TEST01",
-            session_id="TEST01_MR01",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="TEST01",
-            session_id="TEST01_MR02",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="TEST02",
-            session_id="TEST02_MR01",
-            direct_archive=direct_archive,
-        )
-
-        _upload_dicom_data(
-            [t1w_syngo(), fmap_syngo()],
-            config,
-            project_id="TRAINING",
-            subject_id="TEST02",
-            session_id="TEST02_MR02",
-            direct_archive=direct_archive,
-        )
+        series = [t1w_syngo(), fmap_syngo()]
+        for subject_id in ("CONT01", "CONT02", "TEST01", "TEST02"):
+            for visit in ("MR01", "MR02"):
+                uploads.append(
+                    functools.partial(
+                        _upload_dicom_data,
+                        series,
+                        config,
+                        project_id="TRAINING",
+                        subject_id=subject_id,
+                        session_id=f"{subject_id}_{visit}",
+                        direct_archive=direct_archive,
+                    )
+                )
 
     else:
         raise RuntimeError(
             f"Unrecognised dataset '{dataset}', can be one of {AVAILABLE_DATASETS}"
         )
 
+    _run_uploads(uploads, jobs)
+
+
+def _run_uploads(uploads: ty.List[functools.partial], jobs: int):
+    """Runs the session uploads on a pool of "jobs" threads, logging the progress and
+    raising a single error listing all the uploads that failed once the others have
+    finished"""
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {executor.submit(u): _upload_label(u) for u in uploads}
+        for i, future in enumerate(as_completed(futures), start=1):
+            label = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Failed to upload %s: %s", label, e)
+                failed.append((label, e))
+            else:
+                logger.info("Uploaded %s (%d/%d)", label, i, len(uploads))
+    if failed:
+        raise RuntimeError(
+            f"Failed to upload {len(failed)} of {len(uploads)} sessions:\n"
+            + "\n".join(f"    {label}: {e}" for label, e in failed)
+        ) from failed[0][1]
 
-def _upload_dicom_data(
-    to_upload: ty.Union[Path, ty.List[Path], str],
-    config: dict,
-    project_id: str,
-    subject_id: str,
-    session_id: str,
-    direct_archive: bool = True,
-):
-
-    if isinstance(to_upload, str):
-        to_upload = Path(to_upload)
-    if isinstance(to_upload, Path):
-        to_upload = [to_upload]
 
-    work_dir = Path(tempfile.mkdtemp())
+def _upload_label(upload: functools.partial) -> str:
+    kwargs = upload.keywords
+    return f"{kwargs['project_id']}/{kwargs['subject_id']}/{kwargs['session_id']}"
 
-    with connect(config) as login:
 
+def _create_subject(login, config: Config, project_id: str, subject_id: str):
+    """Creates the project and subject if they don't already exist, holding a lock
+    on the project so that concurrent uploads don't try to create them at the same
+    time"""
+    with _project_locks_lock:
+        lock = _project_locks.setdefault(
+            (config.xnat_uri, project_id), threading.Lock()
+        )
+    with lock:
         project_uri = f"/data/archive/projects/{project_id}"
 
         try:
@@ -256,6 +219,26 @@ def _upload_dicom_data(
         }
         login.put(f"{project_uri}/subjects/{subject_id}", query=query)
 
+
+def _upload_dicom_data(
+    to_upload: ty.Union[Path, ty.List[Path], str],
+    config: dict,
+    project_id: str,
+    subject_id: str,
+    session_id: str,
+    direct_archive: bool = True,
+):
+
+    if isinstance(to_upload, str):
+        to_upload = Path(to_upload)
+    if isinstance(to_upload, Path):
+        to_upload = [to_upload]
+
+    with lease_session(config) as login:
+
+        project_uri = f"/data/archive/projects/{project_id}"
+        _create_subject(login, config, project_id, subject_id)
+
         try:
             login.get(f"{project_uri}/subjects/{subject_id}/experiments/{session_id}")
         except XNATResponseError:
@@ -268,25 +251,9 @@ def _upload_dicom_data(
             )
             return
 
-        dicoms_dir = work_dir / "dicoms"
-        dicoms_dir.mkdir()
-
-        for i, dcm_dir in enumerate(to_upload):
-            shutil.copytree(dcm_dir, dicoms_dir / str(i))
-
-        zipped = work_dir / "dicoms.zip"
-
-        with zipfile.ZipFile(
-            zipped,
-            mode="w",
-            compression=zipfile.ZIP_DEFLATED,
-            allowZip64=True,
-        ) as zfile, set_cwd(dicoms_dir):
-            for dcm_dir in dicoms_dir.iterdir():
-                for dcm_file in dcm_dir.iterdir():
-                    zfile.write(dcm_file.relative_to(dicoms_dir))
-
-        with open(zipped, "rb") as f:
+        # Zip the DICOM series in place, streaming the zip straight into the
+        # request body rather than writing it to disk first
+        with PipeStream(lambda f: write_dicom_zip(f, to_upload)) as zipped:
             # Import data
             login.upload_stream(
                 "/data/services/import",
@@ -298,7 +265,7 @@ def _upload_dicom_data(
                     "Direct-Archive": direct_archive,
                     "overwrite": True,
                 },
-                stream=f,
+                stream=zipped,
                 content_type="application/zip",
                 method="post",
             )
@@ -309,6 +276,30 @@ def _upload_dicom_data(
         login.put(f"/data/experiments/{experiment_id}?triggerPipelines=true")
 
 
+def write_dicom_zip(fileobj: ty.BinaryIO, dicom_dirs: ty.List[Path]):
+    """Writes a zip of the DICOM files in each of the given directories (placed in
+    sub-directories named after their index) to a file-like object, which doesn't
+    need to be seekable
+
+    Parameters
+    ----------
+    fileobj : file-like
+        the object to write the zip to
+    dicom_dirs : list[Path]
+        the directories containing the DICOM series
+    """
+    with zipfile.ZipFile(
+        fileobj,
+        mode="w",
+        compression=zipfile.ZIP_DEFLATED,
+        allowZip64=True,
+    ) as zfile:
+        for i, dcm_dir in enumerate(dicom_dirs):
+            for dcm_file in sorted(Path(dcm_dir).iterdir()):
+                if dcm_file.is_file():
+                    zfile.write(dcm_file, arcname=f"{i}/{dcm_file.name}")
+
+
 def _upload_directly(
     to_upload: ty.Dict[str, Path],
     config: dict,
@@ -318,27 +309,10 @@ def _upload_directly(
     resource_name: str,
 ):
 
-    with connect(config) as login:
+    with lease_session(config) as login:
 
         project_uri = f"/data/archive/projects/{project_id}"
-
-        try:
-            login.get(project_uri)
-        except XNATResponseError:
-            login.put(project_uri)
-        else:
-            logger.debug(
-                "'%s' project already exists in test XNAT, skipping add data project",
-                project_id,
-            )
-
-        # Create subject
-        query = {
-            "xsiType": "xnat:subjectData",
-            "req_format": "qs",
-            "xnat:subjectData/label": subject_id,
-        }
-        login.put(f"{project_uri}/subjects/{subject_id}", query=query)
+        _create_subject(login, config, project_id, subject_id)
 
         xproject = login.projects[project_id]
 
@@ -0,0 +1,51 @@
+#!/bin/sh
+# jvm-cds.sh
+#
+# Boots XNAT once at build time to record the classes that are loaded during startup
+# and dumps them into a class-data-sharing (CDS) archive, which the JVM maps into
+# memory on launch instead of loading and verifying the classes from scratch
+
+set -e
+
+CDS_DIR=${CATALINA_HOME}/cds
+CDS_ARCHIVE=$CDS_DIR/xnat.jsa
+CDS_OPTS="-XX:+UnlockDiagnosticVMOptions -XX:SharedArchiveFile=$CDS_ARCHIVE -Xshare:auto"
+PGDATA_BACKUP=/tmp/pgdata-backup
+
+mkdir -p $CDS_DIR
+
+# Unless the warm schema is also requested, restore the database after the training
+# boot so the image is otherwise the same as it would be without CDS
+if [ "$WARM_SCHEMA" != "true" ]; then
+  cp -a $PGDATA $PGDATA_BACKUP
+fi
+
+if java -XX:ArchiveClassesAtExit=/tmp/probe.jsa -version >/dev/null 2>&1; then
+  # JDK 13+ can dump the application classes loaded during the boot on exit
+  rm -f /tmp/probe.jsa
+  CATALINA_OPTS="$CATALINA_OPTS -XX:ArchiveClassesAtExit=$CDS_ARCHIVE" /warm-xnat.sh
+else
+  # JDK 8 can only share classes from the boot class-path, so record the ones that
+  # are loaded and dump them into an archive in a separate step
+  CATALINA_OPTS="$CATALINA_OPTS -verbose:class" \
+    WARM_LOG=$CDS_DIR/training.log KEEP_WARM_LOG=true /warm-xnat.sh
+  grep -E '^\[Loaded [^ ]+ from .*(rt\.jar|shared objects file)\]$' $CDS_DIR/training.log \
+    | sed 's/^\[Loaded \([^ ]*\) .*/\1/' | tr '.' '/' > $CDS_DIR/classlist
+  rm -f $CDS_DIR/training.log
+  java -XX:+UnlockDiagnosticVMOptions -Xshare:dump \
+    -XX:SharedClassListFile=$CDS_DIR/classlist -XX:SharedArchiveFile=$CDS_ARCHIVE
+fi
+
+if [ "$WARM_SCHEMA" != "true" ]; then
+  rm -rf $PGDATA
+  mv $PGDATA_BACKUP $PGDATA
+fi
+
+# Only enable the archive if the JVM can actually map it in
+if java $CDS_OPTS -Xshare:on -version >/dev/null 2>&1; then
+  echo "CATALINA_OPTS=\"\$CATALINA_OPTS $CDS_OPTS\"" >> ${CATALINA_HOME}/bin/setenv.sh
+  >&2 echo "Created CDS archive at $CDS_ARCHIVE"
+else
+  >&2 echo "JVM could not map in the CDS archive, launching without it"
+  rm -rf $CDS_DIR
+fi
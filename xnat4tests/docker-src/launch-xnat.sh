@@ -9,8 +9,13 @@ until psql -U postgres -c '\q'; do
 done
 
 
->&2 echo "Postgres is up - building XNAT database"
-psql -U postgres -f /XNAT.sql
+if [ "$(psql -U postgres -tAc "SELECT 1 FROM pg_database WHERE datname='xnat'")" = "1" ]; then
+  >&2 echo "Postgres is up - XNAT database already exists"
+else
+  >&2 echo "Postgres is up - building XNAT database"
+  psql -U postgres -f /XNAT.sql
+fi
+>&2 echo "XNAT database ready"
 
 >&2 echo "Launching tomcat"
 exec /usr/local/tomcat/bin/catalina.sh run
\ No newline at end of file
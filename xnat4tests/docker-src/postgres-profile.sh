@@ -0,0 +1,33 @@
+#!/bin/sh
+# postgres-profile.sh PROFILE SHARED_BUFFERS WORK_MEM
+#
+# Applies the Postgres durability/performance profile passed as the first argument,
+# along with the memory settings. The "throughput" profile turns off the settings that
+# make commits durable across crashes, which are worthless for disposable test data
+
+set -e
+
+PROFILE=${1:-default}
+CONF=$PGDATA/postgresql.conf
+
+if [ "$PROFILE" != "default" ] && [ "$PROFILE" != "throughput" ]; then
+  >&2 echo "Unrecognised Postgres profile '$PROFILE'"
+  exit 1
+fi
+
+cat >> $CONF << EOF2
+
+shared_buffers = '$2'
+work_mem = '$3'
+# Timestamped in UTC so xnat4tests can time the startup phases from the log
+log_line_prefix = '%m [%p] '
+log_timezone = 'UTC'
+EOF2
+
+if [ "$PROFILE" = "throughput" ]; then
+  cat >> $CONF << EOF2
+fsync = off
+synchronous_commit = off
+full_page_writes = off
+EOF2
+fi
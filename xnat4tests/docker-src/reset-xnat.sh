@@ -0,0 +1,70 @@
+#!/bin/sh
+# reset-xnat.sh [-t] [-d DUMP_FILE] [-s]
+#
+# Resets XNAT to the state it was in once it was first initialised by stopping
+# Tomcat, recreating the XNAT database from its template, clearing the data
+# directories and starting Tomcat again.
+#
+# The template is taken with "-t" by xnat4tests once XNAT has initialised its schema
+# (which Hibernate only does when Tomcat first starts). As the database can't be
+# used as a template while Tomcat is connected to it, "-t" saves a dump of it
+# instead, which the first reset restores and then turns into the template database
+# that later resets copy.
+#
+#   -t            take the template of the current database and exit
+#   -d DUMP_FILE  restore the database from a pg_dump archive instead of the template
+#   -s            leave Tomcat stopped afterwards
+
+set -e
+
+XNAT_ROOT=${XNAT_ROOT:-/data/xnat}
+TEMPLATE_DUMP=${XNAT_TEMPLATE_DUMP:-/var/lib/postgresql/xnat-template.dump}
+
+TAKE_TEMPLATE=false
+DUMP_FILE=
+START_TOMCAT=true
+while getopts "td:s" opt; do
+  case $opt in
+    t) TAKE_TEMPLATE=true ;;
+    d) DUMP_FILE=$OPTARG ;;
+    s) START_TOMCAT=false ;;
+    *) >&2 echo "Usage: reset-xnat.sh [-t] [-d DUMP_FILE] [-s]"; exit 1 ;;
+  esac
+done
+
+if [ "$TAKE_TEMPLATE" = "true" ]; then
+  pg_dump -U postgres -Fc -f "$TEMPLATE_DUMP" xnat
+  psql -U postgres -q -c "DROP DATABASE IF EXISTS xnat_template"
+  exit 0
+fi
+
+if [ -z "$DUMP_FILE" ] && [ ! -f "$TEMPLATE_DUMP" ] && \
+    [ "$(psql -U postgres -tAc "SELECT 1 FROM pg_database WHERE datname='xnat_template'")" != "1" ]; then
+  >&2 echo "No template of the XNAT database has been taken"
+  exit 1
+fi
+
+supervisorctl -c /etc/supervisord.conf stop tomcat
+
+# Drop any connections Tomcat left behind so the database can be dropped
+psql -U postgres -q -c "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = 'xnat' AND pid <> pg_backend_pid()" > /dev/null
+psql -U postgres -q -c "DROP DATABASE IF EXISTS xnat"
+if [ -n "$DUMP_FILE" ]; then
+  psql -U postgres -q -c "CREATE DATABASE xnat OWNER xnat"
+  pg_restore -U postgres -d xnat --exit-on-error "$DUMP_FILE"
+elif [ "$(psql -U postgres -tAc "SELECT 1 FROM pg_database WHERE datname='xnat_template'")" = "1" ]; then
+  psql -U postgres -q -c "CREATE DATABASE xnat TEMPLATE xnat_template OWNER xnat"
+else
+  psql -U postgres -q -c "CREATE DATABASE xnat OWNER xnat"
+  pg_restore -U postgres -d xnat --exit-on-error "$TEMPLATE_DUMP"
+  # Tomcat isn't connected yet, so the restored database can be the template
+  psql -U postgres -q -c "CREATE DATABASE xnat_template TEMPLATE xnat OWNER xnat"
+fi
+
+for dir in archive prearchive build cache; do
+  find $XNAT_ROOT/$dir -mindepth 1 -delete
+done
+
+if [ "$START_TOMCAT" = "true" ]; then
+  supervisorctl -c /etc/supervisord.conf start tomcat
+fi
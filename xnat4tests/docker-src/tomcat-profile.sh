@@ -0,0 +1,40 @@
+#!/bin/sh
+# tomcat-profile.sh
+#
+# Applies the Tomcat startup profile passed as the first argument. The "fast" profile
+# cuts the time Tomcat spends scanning the web-app's JARs and deploying it
+
+set -e
+
+PROFILE=${1:-default}
+CONF=${CATALINA_HOME}/conf
+
+if [ "$PROFILE" = "default" ]; then
+  exit 0
+elif [ "$PROFILE" != "fast" ]; then
+  >&2 echo "Unrecognised Tomcat startup profile '$PROFILE'"
+  exit 1
+fi
+
+# Only scan the JARs that provide tag libraries or servlet container initialisers
+# used by XNAT for TLDs and web-fragments (later properties override earlier ones)
+cat >> $CONF/catalina.properties << EOF2
+
+tomcat.util.scan.StandardJarScanFilter.jarsToSkip=*.jar
+tomcat.util.scan.StandardJarScanFilter.jarsToScan=spring-web*.jar,spring-security-taglibs*.jar,jstl*.jar,taglibs-standard*.jar,xnat-web*.jar,xdat*.jar
+EOF2
+
+# Don't scan the class-path or JAR manifests, and don't persist sessions between
+# restarts
+sed -i 's#</Context>#    <JarScanner scanClassPath="false" scanManifest="false"/><Manager pathname=""/>\n</Context>#' \
+  $CONF/context.xml
+
+# Start the engine and host children in parallel with one thread per core
+sed -i \
+  -e 's#<Engine name="Catalina"#<Engine name="Catalina" startStopThreads="0"#' \
+  -e 's#<Host name="localhost"#<Host name="localhost" startStopThreads="0"#' \
+  $CONF/server.xml
+
+# Don't block on the entropy pool when seeding the session ID generator
+echo 'CATALINA_OPTS="$CATALINA_OPTS -Djava.security.egd=file:/dev/./urandom"' \
+  >> ${CATALINA_HOME}/bin/setenv.sh
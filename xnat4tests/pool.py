@@ -0,0 +1,249 @@
+import os
+import re
+import sys
+import socket
+import warnings
+import typing as ty
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import attrs
+import yaml
+import docker
+from .utils import logger, XNAT4TESTS_HOME
+from .config import Config
+from .clients import docker_client
+from .base import start_xnat, stop_xnat, docker_network
+from .build import build_image
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+XDIST_WORKER_RE = re.compile(r"gw(\d+)")
+# Hosts that free ports can be found on by probing the local machine
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+@attrs.define
+class InstancePool:
+    """A pool of XNAT instances derived from a base configuration that can be run side
+    by side, e.g. one for each pytest-xdist worker. Each instance gets its own
+    container name, host port and root directory. The derived configurations are
+    saved as "<name>-<index>" in the xnat4tests configs directory, so they are shared
+    between processes (and can be passed to the CLI), and the ports allocated to them
+    are kept between sessions. Delete them to reallocate the pool after changing the
+    base configuration.
+
+    Free ports are found by probing the local machine, so pools are only supported
+    for Docker daemons running locally, i.e. where "docker_host" is "localhost"
+
+    Parameters
+    ----------
+    size : int
+        the number of instances in the pool
+    base_config : str or Config
+        the configuration (or name of the configuration file) to derive the
+        configurations of the instances from
+    name : str
+        the name of the pool, used to name the derived configurations
+    """
+
+    size: int = attrs.field(validator=attrs.validators.gt(0))
+    base_config: Config = attrs.field(default="default", converter=Config.load)
+    name: str = "pool"
+
+    @property
+    def configs(self) -> ty.List[Config]:
+        """The configurations of the instances in the pool, which are allocated (and
+        saved) on first access"""
+        with self._lock():
+            return [self._derive_config(i) for i in range(self.size)]
+
+    def config_path(self, index: int) -> Path:
+        return XNAT4TESTS_HOME / "configs" / f"{self.name}-{index}.yaml"
+
+    def start(self, **kwargs) -> ty.List[docker.models.containers.Container]:
+        """Builds the image and launches all instances of the pool concurrently
+
+        Parameters
+        ----------
+        **kwargs
+            passed through to start_xnat (apart from "rebuild")
+
+        Returns
+        -------
+        list[docker.models.containers.Container]
+            the containers of the instances
+        """
+        rebuild = kwargs.pop("rebuild", True)
+        configs = self.configs
+        self._prepare(rebuild)
+        logger.info("Starting %d XNAT instances in '%s' pool", self.size, self.name)
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(
+                executor.map(
+                    lambda c: start_xnat(c, rebuild=False, **kwargs), configs
+                )
+            )
+
+    def stop(self, wait: bool = False):
+        """Stops all instances of the pool concurrently
+
+        Parameters
+        ----------
+        wait : bool
+            wait until the containers have been removed
+        """
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            list(executor.map(lambda c: stop_xnat(c, wait=wait), self.configs))
+
+    def lease(self, worker_id: ty.Optional[str] = None, **kwargs) -> Config:
+        """Starts (or reuses) the instance assigned to a pytest-xdist worker and
+        returns its configuration. Workers are assigned to instances round-robin by
+        their number, so if the pool is as large as the number of workers each worker
+        gets an instance to itself
+
+        Parameters
+        ----------
+        worker_id : str, optional
+            the ID of the xdist worker, e.g. "gw3". Defaults to the PYTEST_XDIST_WORKER
+            environment variable, or the first instance if not running under xdist
+        **kwargs
+            passed through to start_xnat (apart from "rebuild")
+
+        Returns
+        -------
+        Config
+            the configuration of the instance leased to the worker
+        """
+        index = self.worker_index(worker_id)
+        rebuild = kwargs.pop("rebuild", True)
+        with self._lock():
+            config = self._derive_config(index)
+            # Only one worker needs to build the image and create the network
+            self._prepare(rebuild)
+        logger.info(
+            "Leasing %s instance to worker %s", config.docker_container, worker_id
+        )
+        start_xnat(config, rebuild=False, **kwargs)
+        return config
+
+    def worker_index(self, worker_id: ty.Optional[str] = None) -> int:
+        """Returns the index of the instance assigned to a pytest-xdist worker"""
+        if worker_id is None:
+            worker_id = os.environ.get("PYTEST_XDIST_WORKER", "master")
+        match = XDIST_WORKER_RE.fullmatch(worker_id)
+        if not match:
+            return 0
+        return int(match.group(1)) % self.size
+
+    def _prepare(self, rebuild: bool):
+        """Builds the shared image and network before the instances are launched so
+        that the launches don't race to create them"""
+        dc = docker_client(self.base_config)
+        try:
+            if rebuild:
+                raise docker.errors.ImageNotFound("rebuild")
+            dc.images.get(self.base_config.docker_image)
+        except docker.errors.ImageNotFound:
+            build_image(self.base_config, dc)
+        docker_network(self.base_config)
+
+    def _derive_config(self, index: int) -> Config:
+        """Loads the saved configuration of the instance at the given index, or derives
+        it from the base configuration and saves it if it doesn't exist yet. Should be
+        called while holding the pool lock"""
+        config_path = self.config_path(index)
+        if config_path.exists():
+            return Config.load(config_path)
+        base = self.base_config
+        if base.docker_host not in LOCAL_HOSTS:
+            logger.warning(
+                "Ports for the '%s' pool are allocated on the local machine, so may "
+                "clash with ports already in use on %s",
+                self.name,
+                base.docker_host,
+            )
+        root_dir = base.xnat_root_dir.with_name(
+            f"{base.xnat_root_dir.name}-{self.name}-{index}"
+        )
+        with warnings.catch_warnings():
+            # Instances can't all listen on 8080, so ignore the container service
+            # warning about changing the port
+            warnings.simplefilter("ignore")
+            config = attrs.evolve(
+                base,
+                docker_container=f"{base.docker_container}-{self.name}-{index}",
+                xnat_port=str(_free_port(exclude=self._allocated_ports())),
+                xnat_root_dir=root_dir,
+                build_args=attrs.asdict(base.build_args),
+                loaded_from=config_path,
+            )
+        dct = attrs.asdict(
+            config,
+            filter=lambda a, _: a.name != "loaded_from",
+            value_serializer=lambda _, __, v: str(v) if isinstance(v, Path) else v,
+        )
+        config_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(config_path, "w") as f:
+            yaml.dump(dct, f)
+        logger.info(
+            "Allocated port %s to %s", config.xnat_port, config.docker_container
+        )
+        return config
+
+    def _allocated_ports(self) -> ty.Set[int]:
+        return set(
+            int(Config.load(p).xnat_port)
+            for p in (self.config_path(i) for i in range(self.size))
+            if p.exists()
+        )
+
+    @contextmanager
+    def _lock(self):
+        """Locks the configurations of the pool so that concurrent processes (e.g.
+        xdist workers) don't allocate them twice"""
+        lock_path = XNAT4TESTS_HOME / "configs" / f".{self.name}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "w") as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+
+def _lock_file(f):
+    """Blocks until an exclusive lock on the open file is acquired"""
+    if sys.platform == "win32":
+        while True:
+            try:
+                # Retries for 10 seconds before raising
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            except OSError:
+                continue
+            break
+    else:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if sys.platform == "win32":
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _free_port(exclude: ty.Container[int] = ()) -> int:
+    """Returns a TCP port that is currently free on the local machine (assumed to be
+    the Docker host) and isn't in "exclude" (e.g. ports allocated to instances that
+    aren't running)"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("", 0))
+            port = sock.getsockname()[1]
+        if port not in exclude:
+            return port
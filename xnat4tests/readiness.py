@@ -0,0 +1,355 @@
+import re
+import math
+import time
+import uuid
+import queue
+import random
+import threading
+import collections
+import typing as ty
+from datetime import datetime, timezone
+import requests
+from .utils import logger
+from .config import Config
+
+
+# Endpoint that is cheap for XNAT to serve but only succeeds once the web-app has
+# initialised and can authenticate users against the database
+PROBE_ENDPOINT = "/data/JSESSION"
+PROBE_TIMEOUT = 5
+INITIAL_BACKOFF = 0.25
+
+# Log files written by the programs that supervisord runs in the container
+LOG_FILES = ["/var/log/postgresql/postgresql.log", "/var/log/tomcat/tomcat.log"]
+# Phases of the container startup in the order they occur, and the log lines that
+# mark them. XNAT is up once Tomcat reports that it has started
+STARTUP_PHASES = [
+    ("postgres_up", re.compile(r"Postgres is up")),
+    ("database_ready", re.compile(r"XNAT database ready")),
+    (
+        "xnat_context_initialised",
+        re.compile(r"Deployment of web application directory .*ROOT\]? has finished"),
+    ),
+    ("tomcat_started", re.compile(r"Server startup in")),
+]
+# Log lines that show startup has failed
+STARTUP_FAILURES = [
+    re.compile(r"(exited|gave up): (tomcat|postgresql)"),
+    re.compile(r"Context \[.*\] startup failed"),
+    re.compile(r"One or more listeners failed to start"),
+]
+LOG_EXCERPT_LINES = 50
+# Line Postgres logs once it accepts connections, prefixed by its UTC timestamp
+POSTGRES_READY_RE = re.compile(
+    r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}) UTC .*"
+    r"database system is ready to accept connections"
+)
+
+
+def probe(config: Config) -> bool:
+    """Makes a single lightweight request to check whether XNAT is ready to accept
+    logins
+
+    Parameters
+    ----------
+    config : Config
+        the configuration of the XNAT instance to probe
+
+    Returns
+    -------
+    bool
+        whether XNAT is ready
+    """
+    try:
+        response = requests.get(
+            config.xnat_uri + PROBE_ENDPOINT,
+            auth=(config.xnat_user, config.xnat_password),
+            timeout=PROBE_TIMEOUT,
+        )
+    except (requests.ConnectionError, requests.Timeout):
+        return False
+    return response.status_code == 200
+
+
+def backoff_delays(config: Config) -> ty.Iterator[float]:
+    """Generates exponentially increasing delays between readiness probes, capped at
+    "connection_attempt_sleep" and with random jitter so that many instances booting
+    at once don't probe in lock-step
+
+    Parameters
+    ----------
+    config : Config
+        the configuration of the XNAT instance being waited on
+
+    Yields
+    ------
+    float
+        the number of seconds to wait before the next probe
+    """
+    delay = INITIAL_BACKOFF
+    while True:
+        yield delay * random.uniform(0.5, 1.0)
+        delay = min(delay * 2, config.connection_attempt_sleep)
+
+
+def readiness_deadline(config: Config) -> float:
+    """Returns the time (as per time.monotonic) by which XNAT needs to be ready"""
+    timeout = config.readiness_timeout
+    if timeout is None:
+        timeout = config.connection_attempts * config.connection_attempt_sleep
+    return time.monotonic() + timeout
+
+
+def wait_for_http(config: Config):
+    """Waits until XNAT responds to the readiness probe, backing off exponentially
+    between probes
+
+    Parameters
+    ----------
+    config : Config
+        the configuration of the XNAT instance to wait on
+
+    Raises
+    ------
+    TimeoutError
+        if XNAT isn't ready before the readiness timeout
+    """
+    deadline = readiness_deadline(config)
+    for attempt, delay in enumerate(backoff_delays(config), start=1):
+        if probe(config):
+            logger.debug("%s ready after %d probes", config.xnat_uri, attempt)
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"XNAT at {config.xnat_uri} was not ready after {attempt} probes"
+            )
+        logger.debug(
+            "Probe %d of %s failed, retrying in %.1fs", attempt, config.xnat_uri, delay
+        )
+        time.sleep(min(delay, remaining))
+
+
+def wait_for_health(container, config: Config):
+    """Waits for the container's health check to pass by listening for its
+    "health_status" events from the Docker daemon. Falls back to probing XNAT
+    directly if the image the container was launched from doesn't define a health
+    check
+
+    Parameters
+    ----------
+    container : docker.models.containers.Container
+        the container XNAT is starting in
+    config : Config
+        the configuration of the XNAT instance to wait on
+
+    Raises
+    ------
+    RuntimeError
+        if the container exits or is reported as unhealthy
+    TimeoutError
+        if the container isn't healthy before the readiness timeout
+    """
+    deadline = readiness_deadline(config)
+    # Subscribe to the events before checking the current status so none are missed
+    events = container.client.events(
+        decode=True,
+        filters={"container": container.id, "event": ["health_status", "die"]},
+        # An epoch time, as older docker-py versions convert naive datetimes using
+        # the wrong timezone
+        until=math.ceil(time.time() + deadline - time.monotonic()),
+    )
+    try:
+        container.reload()
+        health = container.attrs["State"].get("Health")
+        if health is None:
+            logger.warning(
+                "%s image has no health check, probing XNAT instead", container.name
+            )
+            wait_for_http(config)
+            return
+        if health["Status"] == "healthy":
+            return
+        for event in events:
+            status = event.get("Action") or event.get("status", "")
+            if status == "health_status: healthy":
+                logger.debug("%s reported healthy", container.name)
+                return
+            elif status == "health_status: unhealthy" or status == "die":
+                raise RuntimeError(
+                    f"{container.name} container {status.split(': ')[-1]} while XNAT "
+                    "was starting, last log lines were:\n\n"
+                    + _logs_excerpt(container)
+                )
+    finally:
+        events.close()
+    raise TimeoutError(f"{container.name} container was not healthy in time")
+
+
+def postgres_ready_after(container) -> ty.Optional[float]:
+    """Reads how long after the container (last) started Postgres became ready to
+    accept connections from the timestamps in its log, so that the wait for XNAT can
+    be broken down into phases when it isn't detected from the logs
+
+    Parameters
+    ----------
+    container : docker.models.containers.Container
+        the container XNAT has started in
+
+    Returns
+    -------
+    float or None
+        the number of seconds after the container started that Postgres was ready,
+        or None if it couldn't be determined (e.g. for images built by older versions)
+    """
+    try:
+        result = container.exec_run(["cat", LOG_FILES[0]])
+        container.reload()
+    except Exception:  # the container may have exited
+        return None
+    if result.exit_code:
+        return None
+    started = _parse_docker_time(container.attrs["State"]["StartedAt"])
+    # Restarts append to the log, so the last matching line is from this start
+    for line in reversed(result.output.decode(errors="replace").splitlines()):
+        match = POSTGRES_READY_RE.match(line)
+        if match:
+            ready = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S.%f")
+            seconds = (ready.replace(tzinfo=timezone.utc) - started).total_seconds()
+            return seconds if seconds >= 0 else None
+    return None
+
+
+def _parse_docker_time(timestamp: str) -> datetime:
+    """Parses the RFC 3339 timestamps (with nanoseconds) returned by Docker"""
+    match = re.match(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?", timestamp)
+    fraction = (match.group(2) or ".0")[:7]  # only microseconds can be parsed
+    parsed = datetime.strptime(match.group(1) + fraction, "%Y-%m-%dT%H:%M:%S.%f")
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+def _logs_excerpt(container) -> str:
+    try:
+        return container.logs(tail=LOG_EXCERPT_LINES).decode(errors="replace")
+    except Exception:  # the container may have been removed
+        return ""
+
+
+def wait_for_logs(container, config: Config) -> ty.Dict[str, float]:
+    """Waits until XNAT is up by following the container's logs (i.e. supervisord's
+    output) and the Postgres and Tomcat log files within it, recording when each
+    startup phase is reached and failing as soon as Tomcat or Postgres dies.
+
+    Only lines logged after the wait starts are followed, as the logs of restarted
+    containers (and warm snapshots) still contain the lines from previous boots. If
+    XNAT is already up by the time the logs are being followed, the wait returns
+    straight away
+
+    Parameters
+    ----------
+    container : docker.models.containers.Container
+        the container XNAT is starting in
+    config : Config
+        the configuration of the XNAT instance to wait on
+
+    Returns
+    -------
+    dict[str, float]
+        the number of seconds after the wait started that each startup phase in
+        STARTUP_PHASES was reached
+
+    Raises
+    ------
+    RuntimeError
+        if XNAT fails to start, with an excerpt of the logs leading up to the failure
+    TimeoutError
+        if XNAT isn't up before the readiness timeout
+    """
+    start = time.monotonic()
+    deadline = readiness_deadline(config)
+    pid_file = f"/tmp/xnat4tests-tail-{uuid.uuid4().hex}.pid"
+    lines = queue.Queue()
+    excerpt = collections.deque(maxlen=LOG_EXCERPT_LINES)
+    phases = {}
+
+    logs = container.logs(stream=True, follow=True, since=int(time.time()))
+    tail = container.exec_run(
+        [
+            "sh",
+            "-c",
+            f"echo $$ > {pid_file}; exec tail -n 0 -F {' '.join(LOG_FILES)}",
+        ],
+        stream=True,
+    ).output
+    for stream in (logs, tail):
+        threading.Thread(
+            target=_enqueue_lines, args=(stream, lines), daemon=True
+        ).start()
+
+    try:
+        # Now that the logs are being followed, check whether XNAT was already up
+        if probe(config):
+            logger.debug("%s was already up", config.xnat_uri)
+            phases["tomcat_started"] = round(time.monotonic() - start, 3)
+        while "tomcat_started" not in phases:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(
+                    f"XNAT in {container.name} was not up after "
+                    f"{time.monotonic() - start:.0f}s, "
+                    "last log lines were:\n\n" + "\n".join(excerpt)
+                )
+            try:
+                line = lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if line is None:  # One of the streams ended
+                container.reload()
+                if container.status != "running":
+                    raise RuntimeError(
+                        f"{container.name} container exited while XNAT was starting, "
+                        "last log lines were:\n\n" + "\n".join(excerpt)
+                    )
+                continue
+            excerpt.append(line)
+            if any(r.search(line) for r in STARTUP_FAILURES):
+                raise RuntimeError(
+                    f"XNAT failed to start in {container.name}, last log lines "
+                    "were:\n\n" + "\n".join(excerpt)
+                )
+            for phase, regex in STARTUP_PHASES:
+                if phase not in phases and regex.search(line):
+                    phases[phase] = round(time.monotonic() - start, 3)
+                    logger.info(
+                        "%s reached '%s' after %.1fs",
+                        container.name,
+                        phase,
+                        phases[phase],
+                    )
+    finally:
+        logs.close()
+        try:
+            container.exec_run(
+                ["sh", "-c", f"kill $(cat {pid_file}) 2>/dev/null; rm -f {pid_file}"]
+            )
+        except Exception:  # the container may have exited
+            pass
+    return phases
+
+
+def _enqueue_lines(stream: ty.Iterable[bytes], lines: queue.Queue):
+    """Splits a stream of log output into lines and puts them onto the queue, followed
+    by None when the stream ends"""
+    buffer = b""
+    try:
+        for chunk in stream:
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                lines.put(line.decode(errors="replace").rstrip())
+    except Exception:  # the connection to the daemon is closed when the wait ends
+        pass
+    finally:
+        if buffer:
+            lines.put(buffer.decode(errors="replace").rstrip())
+        lines.put(None)
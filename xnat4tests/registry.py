@@ -1,15 +1,16 @@
 import docker.models.containers
 from .utils import logger
 from .config import Config
-from .base import docker_network, connect
+from .clients import docker_client
+from .base import docker_network, connect, stop_container
 
 
 def start_registry(config_name: str = "default") -> docker.models.containers.Container:
 
     config = Config.load(config_name)
 
-    xnat_docker_network = docker_network()
-    dc = docker.from_env()
+    xnat_docker_network = docker_network(config)
+    dc = docker_client(config)
     try:
         image = dc.images.get(config.docker_registry_image)
     except docker.errors.ImageNotFound:
@@ -38,11 +39,11 @@ def start_registry(config_name: str = "default") -> docker.models.containers.Con
     return container
 
 
-def stop_registry(config_name: str = "default") -> None:
+def stop_registry(config_name: str = "default", wait: bool = False) -> None:
 
     config = Config.load(config_name)
 
-    dc = docker.from_env()
+    dc = docker_client(config)
     try:
         container = dc.containers.get(config.docker_registry_container)
     except docker.errors.NotFound:
@@ -50,4 +51,4 @@ def stop_registry(config_name: str = "default") -> None:
             "Did not find registry running at %s", config.docker_registry_container
         )
     else:
-        container.stop()
+        stop_container(container, wait_for_removal=wait)
@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import shutil
+import tarfile
+import subprocess
+import typing as ty
+from pathlib import Path
+from datetime import datetime
+import docker
+from .utils import logger, PipeStream
+from .config import Config
+from .clients import docker_client, release_sessions
+from .base import connect, _configure_container_service
+from .readiness import wait_for_http
+
+
+COPY_METHODS = ["auto", "reflink", "hardlink", "copy"]
+DUMP_FILE = "xnat.dump"
+METADATA_FILE = "snapshot.json"
+# Where the database dump is placed in the container to restore it
+CONTAINER_DUMP_PATH = "/tmp/xnat4tests-snapshot.dump"
+
+
+def snapshot_xnat(
+    name: str, config_name: ty.Union[str, Config] = "default", method: str = "auto"
+) -> Path:
+    """Takes a named snapshot of the running test XNAT instance, consisting of a dump
+    of its database and copies of its mounted directories, that it can be brought
+    back to with restore_snapshot. The instance should be idle while the snapshot is
+    taken
+
+    Parameters
+    ----------
+    name : str
+        the name of the snapshot, an existing snapshot with the same name is replaced
+    config_name : str or Config
+        the configuration (or name of the configuration file) of the instance
+    method : str
+        how to copy the mounted directories, one of "reflink" (copy-on-write clones,
+        which requires a filesystem that supports them, e.g. Btrfs, XFS or APFS),
+        "hardlink" (only safe if XNAT doesn't modify the files in place, files that
+        can't be hard-linked are copied), "copy" or "auto" (reflinks if supported,
+        otherwise plain copies)
+
+    Returns
+    -------
+    Path
+        the directory the snapshot was saved in
+    """
+    config = Config.load(config_name)
+    _check_method(method)
+    container = _get_container(config)
+    snapshot_dir = _snapshot_dir(config, name)
+    if snapshot_dir.exists():
+        shutil.rmtree(snapshot_dir)
+    snapshot_dir.mkdir(parents=True)
+
+    logger.info("Dumping database of %s", config.docker_container)
+    _dump_database(container, snapshot_dir / DUMP_FILE)
+
+    # How each directory was copied, as "auto" resolves per directory
+    methods = {}
+    for dname in config.xnat_mnt_dirs:
+        logger.info("Copying %s of %s to snapshot", dname, config.docker_container)
+        if config.mnt_mode(dname) != "bind":
+            # Not accessible from the host, so archive it from within the container
+            _archive_dir(container, dname, snapshot_dir / "mounts" / f"{dname}.tar")
+            methods[dname] = "archive"
+            continue
+        dest = snapshot_dir / "mounts" / dname
+        dest.mkdir(parents=True)
+        methods[dname] = copy_tree(config.xnat_root_dir / dname, dest, method)
+
+    with open(snapshot_dir / METADATA_FILE, "w") as f:
+        json.dump(
+            {
+                "created": datetime.now().isoformat(),
+                "container": config.docker_container,
+                "image": container.image.id,
+                "xnat_mnt_dirs": config.xnat_mnt_dirs,
+                "methods": methods,
+            },
+            f,
+        )
+    logger.info("Saved snapshot '%s' of %s", name, config.docker_container)
+    return snapshot_dir
+
+
+def restore_snapshot(
+    name: str, config_name: ty.Union[str, Config] = "default", method: str = "auto"
+):
+    """Restores the running test XNAT instance to a snapshot taken by snapshot_xnat.
+    Tomcat is stopped while the database is restored from the dump and the mounted
+    directories are replaced with copies of the snapshot's, and then started again
+
+    Parameters
+    ----------
+    name : str
+        the name of the snapshot to restore
+    config_name : str or Config
+        the configuration (or name of the configuration file) of the instance
+    method : str
+        how to copy the mounted directories back, see snapshot_xnat
+
+    Raises
+    ------
+    KeyError
+        if there is no snapshot with the given name
+    RuntimeError
+        if the database couldn't be restored
+    """
+    config = Config.load(config_name)
+    _check_method(method)
+    snapshot_dir = _snapshot_dir(config, name)
+    if not (snapshot_dir / METADATA_FILE).exists():
+        raise KeyError(f"No snapshot named '{name}' of {config.docker_container}")
+    with open(snapshot_dir / METADATA_FILE) as f:
+        metadata = json.load(f)
+    container = _get_container(config)
+    if metadata["image"] != container.image.id:
+        logger.warning(
+            "Snapshot '%s' was taken of a container launched from a different image "
+            "than %s, the restored database may not match the XNAT version",
+            name,
+            config.docker_container,
+        )
+
+    logger.info("Restoring snapshot '%s' to %s", name, config.docker_container)
+    release_sessions(config)
+    dump_path = snapshot_dir / DUMP_FILE
+    with PipeStream(
+        lambda f: _write_archive(f, dump_path, Path(CONTAINER_DUMP_PATH).name)
+    ) as archive:
+        container.put_archive(str(Path(CONTAINER_DUMP_PATH).parent), archive)
+    _exec(
+        container, ["/usr/local/bin/reset-xnat.sh", "-s", "-d", CONTAINER_DUMP_PATH]
+    )
+    _exec(container, ["rm", "-f", CONTAINER_DUMP_PATH])
+
+    for dname in metadata["xnat_mnt_dirs"]:
+        if dname not in config.xnat_mnt_dirs:
+            continue
+        # Clear the directory from within the container as the files in it are
+        # owned by the container's user
+        _exec(
+            container, ["find", f"/data/xnat/{dname}", "-mindepth", "1", "-delete"]
+        )
+        archive_path = snapshot_dir / "mounts" / f"{dname}.tar"
+        container_parent = str(Path("/data/xnat", dname).parent)
+        if archive_path.exists():
+            with open(archive_path, "rb") as f:
+                container.put_archive(container_parent, f)
+        elif config.mnt_mode(dname) == "bind":
+            copy_tree(
+                snapshot_dir / "mounts" / dname, config.xnat_root_dir / dname, method
+            )
+        else:
+            # Was bind-mounted when the snapshot was taken but isn't any more
+            with PipeStream(
+                lambda f: _write_archive(f, snapshot_dir / "mounts" / dname)
+            ) as archive:
+                container.put_archive(container_parent, archive)
+
+    _exec(
+        container, ["supervisorctl", "-c", "/etc/supervisord.conf", "start", "tomcat"]
+    )
+    wait_for_http(config)
+    with connect(config) as login:
+        # In case the snapshot was taken with a different root directory
+        _configure_container_service(login, config)
+    logger.info("Restored snapshot '%s' to %s", name, config.docker_container)
+
+
+def list_snapshots(config_name: ty.Union[str, Config] = "default") -> ty.List[str]:
+    """Lists the names of the snapshots of the test XNAT instance"""
+    config = Config.load(config_name)
+    snapshots_dir = config.snapshots_dir / config.docker_container
+    if not snapshots_dir.exists():
+        return []
+    return sorted(
+        p.name for p in snapshots_dir.iterdir() if (p / METADATA_FILE).exists()
+    )
+
+
+def copy_tree(src: Path, dest: Path, method: str = "auto") -> str:
+    """Copies the contents of the "src" directory into the existing "dest" directory
+
+    Parameters
+    ----------
+    src : Path
+        the directory to copy the contents of
+    dest : Path
+        the directory to copy them into
+    method : str
+        one of "reflink", "hardlink", "copy" or "auto" (reflinks if the filesystem
+        supports them, otherwise plain copies)
+
+    Returns
+    -------
+    str
+        the method that was used
+    """
+    children = sorted(src.iterdir())
+    if method in ("auto", "reflink") and children:
+        try:
+            _reflink(children, dest)
+        except subprocess.CalledProcessError as e:
+            if method == "reflink":
+                raise RuntimeError(
+                    f"Could not clone {src} to {dest} with reflinks:\n{e.stderr}"
+                )
+            logger.info("Reflinks not supported for %s, copying instead", src)
+            # Remove any partial clone before copying
+            for child in dest.iterdir():
+                if child.is_dir() and not child.is_symlink():
+                    shutil.rmtree(child)
+                else:
+                    child.unlink()
+        else:
+            return "reflink"
+        method = "copy"
+    elif method == "auto":
+        method = "copy"
+    copy_function = _link_or_copy if method == "hardlink" else shutil.copy2
+    for child in children:
+        if child.is_dir() and not child.is_symlink():
+            shutil.copytree(
+                child, dest / child.name, symlinks=True, copy_function=copy_function
+            )
+        elif child.is_symlink():
+            os.symlink(os.readlink(child), dest / child.name)
+        else:
+            copy_function(child, dest / child.name)
+    return method
+
+
+def _link_or_copy(src: str, dest: str):
+    """Hard-links a file, falling back to copying it if the link isn't permitted, e.g.
+    for files owned by the container's root user when fs.protected_hardlinks is set
+    (the default on most Linux hosts)"""
+    try:
+        os.link(src, dest)
+    except PermissionError:
+        shutil.copy2(src, dest)
+
+
+def _reflink(paths: ty.List[Path], dest: Path):
+    if sys.platform == "darwin":
+        cmd = ["cp", "-a", "-c"]  # clonefile(2) on APFS
+    else:
+        cmd = ["cp", "-a", "--reflink=always"]
+    subprocess.run(
+        cmd + [str(p) for p in paths] + [str(dest)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def _dump_database(container, dump_path: Path):
+    """Streams a pg_dump of the XNAT database out of the container into a file"""
+    api = container.client.api
+    exec_id = api.exec_create(
+        container.id, ["pg_dump", "-U", "postgres", "-Fc", "xnat"]
+    )["Id"]
+    stderr = b""
+    with open(dump_path, "wb") as f:
+        # Separate stderr from the dump so it can be included in any error
+        for out, err in api.exec_start(exec_id, stream=True, demux=True):
+            if out:
+                f.write(out)
+            if err:
+                stderr += err
+    exit_code = api.exec_inspect(exec_id)["ExitCode"]
+    if exit_code:
+        raise RuntimeError(
+            f"pg_dump of XNAT database in {container.name} failed with exit code "
+            f"{exit_code}:\n\n" + stderr.decode(errors="replace")
+        )
+
+
+def _archive_dir(container, dname: str, archive_path: Path):
+    """Saves a tar archive of a directory mounted into the container"""
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+    stream, _ = container.get_archive(f"/data/xnat/{dname}")
+    with open(archive_path, "wb") as f:
+        for chunk in stream:
+            f.write(chunk)
+
+
+def _write_archive(
+    fileobj: ty.BinaryIO, path: Path, arcname: ty.Optional[str] = None
+):
+    with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+        tar.add(str(path), arcname=arcname if arcname else path.name)
+
+
+def _exec(container, cmd: ty.List[str]):
+    result = container.exec_run(cmd)
+    if result.exit_code:
+        raise RuntimeError(
+            f"'{' '.join(cmd)}' failed in {container.name}:\n\n"
+            + result.output.decode(errors="replace")
+        )
+
+
+def _get_container(config: Config):
+    dc = docker_client(config)
+    try:
+        return dc.containers.get(config.docker_container)
+    except docker.errors.NotFound:
+        raise RuntimeError(f"Test XNAT is not running at {config.docker_container}")
+
+
+def _snapshot_dir(config: Config, name: str) -> Path:
+    return config.snapshots_dir / config.docker_container / name
+
+
+def _check_method(method: str):
+    if method not in COPY_METHODS:
+        raise ValueError(
+            f"Unrecognised copy method '{method}', can be one of {COPY_METHODS}"
+        )
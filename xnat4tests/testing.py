@@ -0,0 +1,136 @@
+"""Pytest plugin that provides session-scoped fixtures for testing against a test XNAT
+instance. It is registered through the "pytest11" entry point, so it is available in
+any project that has xnat4tests installed. By default a healthy running instance that
+was launched from the image matching the current build fingerprint is reused between
+test runs, and left running afterwards for the next run
+"""
+import typing as ty
+import pytest
+import docker
+from .config import Config
+from .clients import docker_client
+from .base import start_xnat, stop_xnat, connect
+from .data import add_data, AVAILABLE_DATASETS
+from .pool import InstancePool
+from .utils import logger
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("xnat4tests", "test XNAT instance")
+    group.addoption(
+        "--xnat-config",
+        default=None,
+        help=(
+            "Name of (or path to) the xnat4tests configuration of the test XNAT "
+            "instance (default: the 'xnat4tests_config' ini option or 'default')"
+        ),
+    )
+    group.addoption(
+        "--xnat-relaunch",
+        action="store_true",
+        default=False,
+        help="Relaunch the test XNAT instance instead of reusing a running one",
+    )
+    group.addoption(
+        "--xnat-teardown",
+        action="store_true",
+        default=False,
+        help="Stop the test XNAT instance at the end of the session",
+    )
+    group.addoption(
+        "--xnat-data",
+        action="append",
+        default=[],
+        choices=AVAILABLE_DATASETS,
+        help=(
+            "Dataset to add to the test XNAT instance when it is launched, can be "
+            "given multiple times"
+        ),
+    )
+    group.addoption(
+        "--xnat-pool",
+        type=int,
+        default=0,
+        help=(
+            "Lease each pytest-xdist worker an instance from a pool of this size "
+            "derived from the configuration"
+        ),
+    )
+    parser.addini(
+        "xnat4tests_config",
+        default="default",
+        help="Name of (or path to) the xnat4tests configuration to test against",
+    )
+
+
+@pytest.fixture(scope="session")
+def xnat_pool(pytestconfig) -> ty.Optional[InstancePool]:
+    """The pool the instances of pytest-xdist workers are leased from, if enabled"""
+    pool_size = pytestconfig.getoption("xnat_pool")
+    if not pool_size:
+        return None
+    return InstancePool(size=pool_size, base_config=_base_config(pytestconfig))
+
+
+@pytest.fixture(scope="session")
+def xnat_config(pytestconfig, xnat_pool) -> Config:
+    """The configuration of the test XNAT instance"""
+    if xnat_pool is not None:
+        return xnat_pool.configs[xnat_pool.worker_index()]
+    return _base_config(pytestconfig)
+
+
+@pytest.fixture(scope="session")
+def xnat_instance(pytestconfig, xnat_config, xnat_pool):
+    """Launches the test XNAT instance (or reuses the running one) and yields its
+    container"""
+    relaunch = pytestconfig.getoption("xnat_relaunch")
+    existing = _running_container(xnat_config)
+    if existing is not None and _is_unhealthy(existing):
+        logger.warning(
+            "%s container is unhealthy, relaunching", xnat_config.docker_container
+        )
+        relaunch = True
+    if xnat_pool is not None:
+        # Leasing serialises the image build between the workers
+        xnat_pool.lease(relaunch=relaunch)
+        container = _running_container(xnat_config)
+    else:
+        container = start_xnat(xnat_config, relaunch=relaunch)
+    if existing is None or container.id != existing.id:
+        for dataset in pytestconfig.getoption("xnat_data"):
+            add_data(dataset, config_name=xnat_config)
+    yield container
+    if pytestconfig.getoption("xnat_teardown"):
+        stop_xnat(xnat_config)
+
+
+@pytest.fixture(scope="session")
+def xnat_login(xnat_config, xnat_instance):
+    """An XnatPy session connected to the test XNAT instance"""
+    with connect(xnat_config) as login:
+        yield login
+
+
+def _base_config(pytestconfig) -> Config:
+    return Config.load(
+        pytestconfig.getoption("xnat_config")
+        or pytestconfig.getini("xnat4tests_config")
+    )
+
+
+def _running_container(
+    config: Config,
+) -> ty.Optional[docker.models.containers.Container]:
+    dc = docker_client(config)
+    try:
+        return dc.containers.get(config.docker_container)
+    except docker.errors.NotFound:
+        return None
+
+
+def _is_unhealthy(container: docker.models.containers.Container) -> bool:
+    health = container.attrs["State"].get("Health")
+    return container.status != "running" or (
+        health is not None and health["Status"] == "unhealthy"
+    )
@@ -0,0 +1,129 @@
+import json
+import math
+import time
+import typing as ty
+from contextlib import contextmanager
+from datetime import datetime
+from .utils import logger
+from .config import Config
+
+
+HISTORY_FILE = "startups.jsonl"
+
+
+class StartupTimer:
+    """Records the wall time taken by each phase of starting an XNAT instance, so
+    that they can be appended to the startup history in the reports directory"""
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.start = time.monotonic()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Context manager that times the phase executed within it"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name: str, seconds: float):
+        """Adds the time of a phase that was measured separately"""
+        self.phases[name] = self.phases.get(name, 0.0) + round(seconds, 3)
+
+    def write(self, config: Config, **details) -> ty.Dict[str, ty.Any]:
+        """Appends the timings to the startup history of the reports directory
+
+        Parameters
+        ----------
+        config : Config
+            the configuration of the started instance
+        **details
+            additional details to store in the record
+
+        Returns
+        -------
+        dict
+            the record that was appended
+        """
+        record = {
+            "started": self.started.isoformat(),
+            "container": config.docker_container,
+            "image": config.docker_image,
+            "xnat_version": config.build_args.xnat_version,
+            "xnat_cs_plugin_version": config.build_args.xnat_cs_plugin_version,
+            "seconds": round(time.monotonic() - self.start, 3),
+            "phases": self.phases,
+        }
+        record.update(details)
+        config.reports_dir.mkdir(parents=True, exist_ok=True)
+        with open(config.reports_dir / HISTORY_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        logger.info(
+            "Started %s in %.1fs (%s)",
+            config.docker_container,
+            record["seconds"],
+            ", ".join(f"{k}: {v:.1f}s" for k, v in self.phases.items()),
+        )
+        return record
+
+
+def load_history(config: Config, last: ty.Optional[int] = None) -> ty.List[dict]:
+    """Loads the startup history of the container specified by the configuration
+
+    Parameters
+    ----------
+    config : Config
+        the configuration to load the history of
+    last : int, optional
+        only load the given number of most recent records
+
+    Returns
+    -------
+    list[dict]
+        the startup records, oldest first
+    """
+    history_path = config.reports_dir / HISTORY_FILE
+    if not history_path.exists():
+        return []
+    with open(history_path) as f:
+        records = [json.loads(ln) for ln in f if ln.strip()]
+    records = [r for r in records if r["container"] == config.docker_container]
+    if last:
+        records = records[-last:]
+    return records
+
+
+def summarise(
+    records: ty.List[dict], percentiles: ty.Sequence[int] = (50, 90, 99)
+) -> ty.Dict[str, ty.Dict[str, float]]:
+    """Calculates percentiles of the time taken by each startup phase
+
+    Parameters
+    ----------
+    records : list[dict]
+        the startup records to summarise
+    percentiles : sequence[int]
+        the percentiles to calculate
+
+    Returns
+    -------
+    dict[str, dict[str, float]]
+        the number of records and requested percentiles of each phase (and the
+        "total"), e.g. {"image": {"n": 10, "p50": 0.5, ...}}
+    """
+    phase_times = {}
+    for record in records:
+        for phase, seconds in record["phases"].items():
+            phase_times.setdefault(phase, []).append(seconds)
+        phase_times.setdefault("total", []).append(record["seconds"])
+    summary = {}
+    for phase, times in phase_times.items():
+        times = sorted(times)
+        summary[phase] = {"n": len(times)}
+        for p in percentiles:
+            # Nearest-rank percentile
+            summary[phase][f"p{p}"] = times[max(math.ceil(p / 100 * len(times)) - 1, 0)]
+    return summary
@@ -1,5 +1,9 @@
 import os
+import io
+import queue
 import logging
+import threading
+import typing as ty
 from pathlib import Path
 
 
@@ -20,3 +24,107 @@ def set_loggers(loglevel):
         logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     )
     logger.addHandler(ch)
+
+
+class PipeStream(io.RawIOBase):
+    """A read-only stream of the bytes written by a function that is run in a
+    background thread, e.g. a tar or zip writer, so that they can be passed to
+    an HTTP request body without being buffered in memory or on disk first.
+    At most "max_chunks" writes are held in memory at any one time.
+
+    Parameters
+    ----------
+    write_to : callable
+        function that takes a writable file-like object to write the stream to
+    max_chunks : int
+        the maximum number of writes to buffer before the writer thread blocks
+    """
+
+    CHUNK_SIZE = 2**16
+
+    def __init__(self, write_to: ty.Callable[[ty.BinaryIO], None], max_chunks=64):
+        super().__init__()
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._chunk = memoryview(b"")
+        self._position = 0
+        self._eof = False
+        self._error = None
+        self._reader_closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(write_to,), daemon=True)
+        self._thread.start()
+
+    def _run(self, write_to):
+        try:
+            write_to(_PipeWriter(self._put))
+        except BaseException as e:
+            self._error = e
+        finally:
+            try:
+                self._put(None)
+            except BrokenPipeError:
+                pass
+
+    def _put(self, chunk):
+        while not self._reader_closed.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.1)
+            except queue.Full:
+                continue
+            else:
+                return
+        raise BrokenPipeError("Reader of the stream has been closed")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            if self._eof:
+                return 0
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+            self._chunk = memoryview(chunk)
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Only allow the no-op "rewind" that HTTP clients perform before sending
+        if whence == io.SEEK_SET and offset == 0 and self._position == 0:
+            return 0
+        raise io.UnsupportedOperation("PipeStream is not seekable")
+
+    def __next__(self):
+        chunk = self.read(self.CHUNK_SIZE)
+        if not chunk:
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        self._reader_closed.set()
+        super().close()
+
+
+class _PipeWriter(io.RawIOBase):
+    """The writable end of a PipeStream"""
+
+    def __init__(self, put: ty.Callable[[bytes], None]):
+        super().__init__()
+        self._put = put
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self._put(bytes(data))
+        return len(data)